@@ -3,19 +3,36 @@ import os
 from flask import Flask
 from flask_cors import CORS
 from config import Config
-from models import db, seed_alergenios_from_json
+from models import FichaTecnica, FichaTotais, Produto, ProdutoAlergenioEfetivo, db, seed_alergenios_from_json
 from routes.api_import import import_bp
 from routes.api_fichas import fichas_bp
 from routes.api_reset import reset_bp
 from routes.api_referencias import referencias_bp
 from routes.api_alergenios import alergenios_bp
 from routes.api_pricing_policy import pricing_policy_bp
+from routes.api_componentes import componentes_bp
+from routes.api_pesquisa import pesquisa_bp
+from services.alergenios_efetivos import backfill_alergenios_efetivos
+from services.compressao import init_compressao
+from services.custos_multinivel import backfill_custos_multinivel
+from services.ficha_totais import backfill_totais
+from services.import_jobs import recover_interrupted_jobs
+from services.import_validation import init_validation_pool
+from services.pesquisa import init_pesquisa
+from services.storage import init_storage
+from services.utilizacoes import backfill_utilizacoes
 
 app = Flask(__name__)
 app.config.from_object(Config)
 
 CORS(app)
 db.init_app(app)
+# antes de init_storage, que arranca a primeira thread; com o reloader do
+# debug (python app.py) o processo pai só vigia os ficheiros e não precisa dele
+if __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+    init_validation_pool(app)
+init_storage(app)
+init_compressao(app)
 
 app.register_blueprint(import_bp, url_prefix='/api')
 app.register_blueprint(fichas_bp)   # já tem url_prefix dentro do ficheiro
@@ -23,11 +40,23 @@ app.register_blueprint(reset_bp)    # já tem url_prefix dentro do ficheiro
 app.register_blueprint(referencias_bp)
 app.register_blueprint(alergenios_bp)
 app.register_blueprint(pricing_policy_bp)
+app.register_blueprint(componentes_bp)
+app.register_blueprint(pesquisa_bp)
 
 with app.app_context():
     db.create_all()
+    # create_all não acrescenta índices novos a tabelas que já existem
+    for model in (Produto, FichaTecnica, FichaTotais, ProdutoAlergenioEfetivo):
+        for index in model.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
     seed_file = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "docs", "resources", "allergens.json"))
     seed_alergenios_from_json(seed_file)
+    recover_interrupted_jobs()
+    backfill_totais()
+    backfill_custos_multinivel()
+    backfill_alergenios_efetivos()
+    backfill_utilizacoes()
+    init_pesquisa()
     print("BD pronta e rotas carregadas!")
 
 if __name__ == '__main__':
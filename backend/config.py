@@ -5,11 +5,73 @@ load_dotenv()
 
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 
+
+def _database_url():
+    url = os.environ.get('DATABASE_URL')
+    if not url:
+        return f"sqlite:///{os.path.join(BASE_DIR, 'databases', 'ftv.db')}"
+    # alguns fornecedores ainda usam o esquema antigo postgres://
+    if url.startswith('postgres://'):
+        url = url.replace('postgres://', 'postgresql://', 1)
+    return url
+
+
+def _jobs_database_url(url):
+    # com SQLite os trabalhos de importação ficam noutro ficheiro: registar um
+    # trabalho ou um erro não espera pela transação de uma importação em curso
+    if url.startswith('sqlite'):
+        return f"sqlite:///{os.path.join(BASE_DIR, 'databases', 'import_jobs.db')}"
+    return url
+
+
+def _engine_options(url):
+    if not url.startswith('postgresql'):
+        return {}
+    options = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE') or 10),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW') or 20),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT') or 30),
+        'pool_recycle': 1800,
+        'pool_pre_ping': True,
+    }
+    if url.startswith(('postgresql://', 'postgresql+psycopg2://')):
+        # updates em lote com execute_batch em vez de um pedido por linha
+        options['executemany_mode'] = 'values_plus_batch'
+    return options
+
+
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-super-secreto-123'
-    SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(BASE_DIR, 'databases', 'ftv.db')}"
+    # Base de dados: DATABASE_URL (PostgreSQL) ou, por omissão, SQLite local
+    SQLALCHEMY_DATABASE_URI = _database_url()
+    SQLALCHEMY_ENGINE_OPTIONS = _engine_options(SQLALCHEMY_DATABASE_URI)
+    SQLALCHEMY_BINDS = {'jobs': _jobs_database_url(SQLALCHEMY_DATABASE_URI)}
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     DEBUG = True
+
+    # Perfil SQLite, aplicado a cada ligação
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS') or 5000)
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS') or 'NORMAL'
+    SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB') or 64 * 1024)
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE') or 256 * 1024 * 1024)
+    # Fichas serializadas em cache (por versão do catálogo)
+    FICHAS_CACHE_SIZE = int(os.environ.get('FICHAS_CACHE_SIZE') or 20000)
+    # ANALYZE/optimize periódico, em segundos (0 desliga)
+    DB_OPTIMIZE_INTERVAL = int(os.environ.get('DB_OPTIMIZE_INTERVAL') or 3600)
+    # Compressão gzip/deflate das respostas JSON maiores do que isto (bytes)
+    RESPONSE_COMPRESS_MIN_SIZE = int(os.environ.get('RESPONSE_COMPRESS_MIN_SIZE') or 1024)
+    RESPONSE_COMPRESS_LEVEL = int(os.environ.get('RESPONSE_COMPRESS_LEVEL') or 6)
+
+    # Importação Excel: nº de linhas lidas e confirmadas de cada vez
+    IMPORT_CHUNK_ROWS = int(os.environ.get('IMPORT_CHUNK_ROWS') or 5000)
+    IMPORT_WORKERS = int(os.environ.get('IMPORT_WORKERS') or 1)
+    # tracemalloc mede o pico de memória de cada etapa, mas abranda a importação
+    IMPORT_TRACE_MEMORY = os.environ.get('IMPORT_TRACE_MEMORY') == '1'
+    # Validação sem escrita (dryRun): folhas acima deste nº de linhas usam um
+    # pool de processos, só se IMPORT_VALIDATION_WORKERS for indicado (no
+    # máximo um por CPU; 0 ou 1 valida em série, sem processos extra)
+    IMPORT_VALIDATION_PARALLEL_ROWS = int(os.environ.get('IMPORT_VALIDATION_PARALLEL_ROWS') or 50000)
+    IMPORT_VALIDATION_WORKERS = int(os.environ.get('IMPORT_VALIDATION_WORKERS') or 0)
     
     # Pastas
     UPLOAD_FOLDER = os.path.join(os.path.dirname(BASE_DIR), 'imports')
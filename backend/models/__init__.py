@@ -75,6 +75,20 @@ class Produto(db.Model):
         back_populates="produtos",
         cascade="all",
     )
+    totais = db.relationship("FichaTotais", uselist=False, viewonly=True)
+    custo_multinivel = db.relationship("FichaCustoMultinivel", uselist=False, viewonly=True)
+    alergenios_efetivos = db.relationship(
+        "ProdutoAlergenioEfetivo",
+        viewonly=True,
+        order_by="(ProdutoAlergenioEfetivo.AlergenioId, ProdutoAlergenioEfetivo.OrigemCodigo)",
+    )
+
+    # filtros e ordenações da lista de fichas (terminam no código para a paginação)
+    __table_args__ = (
+        db.Index("ix_produtos_familia_subFamilia", "familia", "subFamilia", "codigo"),
+        db.Index("ix_produtos_ativo_descontinuado_menu", "ativo", "descontinuado", "menu", "codigo"),
+        db.Index("ix_produtos_produto", "produto", "codigo"),
+    )
 
 
 class FichaTecnica(db.Model):
@@ -86,7 +100,7 @@ class FichaTecnica(db.Model):
     )
     produtoNome = db.Column("produtoNome", db.String(200))
     familiaSubfamilia = db.Column("familiaSubfamilia", db.String(200))
-    componenteCodigo = db.Column("componenteCodigo", db.String(50), nullable=False)
+    componenteCodigo = db.Column("componenteCodigo", db.String(50), nullable=False, index=True)
     componenteNome = db.Column("componenteNome", db.String(200))
     qtd = db.Column("qtd", db.Numeric(12, 4))
     unidade = db.Column("unidade", db.String(50))
@@ -106,6 +120,49 @@ class FichaTecnica(db.Model):
     )
 
 
+# Totais de cada ficha (custo e peso), mantidos pelas importações para que as
+# listagens não tenham de ler as linhas da composição
+class FichaTotais(db.Model):
+    __tablename__ = "FichaTotais"
+    __table_args__ = (db.Index("ix_FichaTotais_Custo_Codigo", "CustoCalculado", "ProdutoCodigo"),)
+
+    ProdutoCodigo = db.Column(
+        "ProdutoCodigo", db.String(50), db.ForeignKey("produtos.codigo"), primary_key=True
+    )
+    NumLinhas = db.Column("NumLinhas", db.Integer, nullable=False, default=0)
+    CustoCalculado = db.Column("CustoCalculado", db.Float, nullable=False, default=0)
+    PesoTotal = db.Column("PesoTotal", db.Float, nullable=False, default=0)
+    CustoPorUnidadeBase = db.Column("CustoPorUnidadeBase", db.Float, nullable=False, default=0)
+    AtualizadoEm = db.Column("AtualizadoEm", db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+# Custo com as sub-fichas expandidas (componentes que têm ficha própria),
+# recalculado para o catálogo inteiro no fim de cada importação de fichas
+class FichaCustoMultinivel(db.Model):
+    __tablename__ = "FichaCustosMultinivel"
+
+    ProdutoCodigo = db.Column(
+        "ProdutoCodigo", db.String(50), db.ForeignKey("produtos.codigo"), primary_key=True
+    )
+    CustoTotal = db.Column("CustoTotal", db.Float, nullable=False, default=0)
+    Profundidade = db.Column("Profundidade", db.Integer, nullable=False, default=1)
+    Ciclo = db.Column("Ciclo", db.Boolean, nullable=False, default=False)
+    # JSON: custo por nível, o 1.º são as linhas da própria ficha
+    Niveis = db.Column("Niveis", db.Text, nullable=False)
+    AtualizadoEm = db.Column("AtualizadoEm", db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def serialize(self):
+        return {
+            "custo_total": self.CustoTotal,
+            "profundidade": self.Profundidade,
+            "ciclo": self.Ciclo,
+            "niveis": [
+                {"nivel": nivel, "custo": custo}
+                for nivel, custo in enumerate(json.loads(self.Niveis), start=1)
+            ],
+        }
+
+
 class PrecoTaxa(db.Model):
     __tablename__ = "precos_taxas"
 
@@ -163,6 +220,61 @@ class ProdutoAlergenio(db.Model):
     )
 
 
+# Onde é usado cada componente: fichas que o usam diretamente (profundidade 1)
+# ou através de sub-fichas, pelo caminho mais curto. O caminho guarda-se só
+# pelo primeiro passo (ViaCodigo, a linha da própria ficha); o resto é a
+# utilização do mesmo componente na ficha ViaCodigo.
+class ComponenteUtilizacao(db.Model):
+    __tablename__ = "ComponenteUtilizacoes"
+    __table_args__ = (
+        db.Index("ix_ComponenteUtilizacoes_Componente", "ComponenteCodigo", "Profundidade", "FichaCodigo"),
+        db.Index("ix_ComponenteUtilizacoes_Ficha", "FichaCodigo"),
+    )
+
+    Id = db.Column("Id", db.Integer, primary_key=True)
+    ComponenteCodigo = db.Column("ComponenteCodigo", db.String(50), nullable=False)
+    FichaCodigo = db.Column("FichaCodigo", db.String(50), db.ForeignKey("produtos.codigo"), nullable=False)
+    Profundidade = db.Column("Profundidade", db.Integer, nullable=False)
+    ViaCodigo = db.Column("ViaCodigo", db.String(50), nullable=False)
+    QtdVia = db.Column("QtdVia", db.Float, nullable=False, default=0)
+    # quantidade do componente por unidade da ficha (produto das qtd do caminho)
+    Quantidade = db.Column("Quantidade", db.Float, nullable=False, default=0)
+
+    ficha = db.relationship("Produto", viewonly=True)
+
+    def serialize(self):
+        return {
+            "ficha_codigo": self.FichaCodigo,
+            "ficha_nome": self.ficha.produto if self.ficha else None,
+            "profundidade": self.Profundidade,
+            "quantidade": self.Quantidade,
+        }
+
+
+# Alergénios do produto incluindo os herdados da composição (SPEC §7.4), com a
+# origem: o próprio produto (atribuição direta) ou o componente que o trouxe
+class ProdutoAlergenioEfetivo(db.Model):
+    __tablename__ = "ProdutoAlergeniosEfetivos"
+
+    Id = db.Column("Id", db.Integer, primary_key=True)
+    ProdutoCodigo = db.Column(
+        "ProdutoCodigo", db.String(50), db.ForeignKey("produtos.codigo"), nullable=False
+    )
+    AlergenioId = db.Column(
+        "AlergenioId", db.Integer, db.ForeignKey("Alergenios.Id"), nullable=False
+    )
+    OrigemCodigo = db.Column("OrigemCodigo", db.String(50), nullable=False)
+
+    alergenio = db.relationship("Alergenio", viewonly=True)
+
+    __table_args__ = (
+        db.UniqueConstraint(
+            "ProdutoCodigo", "AlergenioId", "OrigemCodigo", name="uq_produto_alergenio_efetivo"
+        ),
+        db.Index("ix_ProdutoAlergeniosEfetivos_Alergenio", "AlergenioId", "ProdutoCodigo"),
+    )
+
+
 # ===================================================================
 # TABELAS DE REFERÊNCIA
 # ===================================================================
@@ -217,6 +329,113 @@ class PricingPolicy(db.Model):
         }
 
 
+# ===================================================================
+# IMPORTAÇÕES
+# ===================================================================
+
+
+# Trabalhos e erros de importação ficam na BD "jobs" (SQLALCHEMY_BINDS): com
+# SQLite, um ficheiro à parte cujo lock de escrita não é o da importação em curso
+class ImportJob(db.Model):
+    __tablename__ = "ImportJobs"
+    __bind_key__ = "jobs"
+
+    Id = db.Column("Id", db.String(32), primary_key=True, default=lambda: uuid.uuid4().hex)
+    Tipo = db.Column("Tipo", db.String(20), nullable=False)
+    Ficheiro = db.Column("Ficheiro", db.String(255))
+    Estado = db.Column("Estado", db.String(20), nullable=False, default="pendente")
+    Etapa = db.Column("Etapa", db.String(30))
+    LinhasProcessadas = db.Column("LinhasProcessadas", db.Integer, default=0)
+    LinhasLidas = db.Column("LinhasLidas", db.Integer, default=0)
+    LinhasImportadas = db.Column("LinhasImportadas", db.Integer, default=0)
+    NumErros = db.Column("NumErros", db.Integer, default=0)
+    # contagem de erros por código; o detalhe fica em ImportErros
+    ResumoErros = db.Column("ResumoErros", db.Text)
+    Resultado = db.Column("Resultado", db.Text)
+    CriadoEm = db.Column("CriadoEm", db.DateTime, default=datetime.utcnow)
+    IniciadoEm = db.Column("IniciadoEm", db.DateTime)
+    TerminadoEm = db.Column("TerminadoEm", db.DateTime)
+
+    def serialize(self, progresso=None):
+        # progresso: (etapa, linhas) de uma importação ainda por confirmar
+        etapa, linhas = progresso or (self.Etapa, self.LinhasProcessadas or 0)
+        linhas_por_segundo = None
+        if self.IniciadoEm:
+            duracao = ((self.TerminadoEm or datetime.utcnow()) - self.IniciadoEm).total_seconds()
+            linhas_por_segundo = round(linhas / duracao, 1) if duracao > 0 else None
+
+        return {
+            "id": self.Id,
+            "tipo": self.Tipo,
+            "ficheiro": self.Ficheiro,
+            "estado": self.Estado,
+            "etapa": etapa,
+            "linhasProcessadas": linhas,
+            "linhasPorSegundo": linhas_por_segundo,
+            "linhasLidas": self.LinhasLidas or 0,
+            "linhasImportadas": self.LinhasImportadas or 0,
+            "numErros": self.NumErros or 0,
+            "resumoErros": json.loads(self.ResumoErros) if self.ResumoErros else {},
+            "resultado": json.loads(self.Resultado) if self.Resultado else None,
+            "criadoEm": self.CriadoEm.isoformat() if self.CriadoEm else None,
+            "iniciadoEm": self.IniciadoEm.isoformat() if self.IniciadoEm else None,
+            "terminadoEm": self.TerminadoEm.isoformat() if self.TerminadoEm else None,
+        }
+
+
+class ImportErro(db.Model):
+    __tablename__ = "ImportErros"
+    __bind_key__ = "jobs"
+    # (ImportId, Id) serve a paginação por chave dos erros de uma importação
+    __table_args__ = (db.Index("ix_ImportErros_ImportId_Id", "ImportId", "Id"),)
+
+    Id = db.Column("Id", db.Integer, primary_key=True)
+    ImportId = db.Column("ImportId", db.String(32), db.ForeignKey("ImportJobs.Id"), nullable=False)
+    Linha = db.Column("Linha", db.Integer)
+    Codigo = db.Column("Codigo", db.String(10), nullable=False)
+    Mensagem = db.Column("Mensagem", db.Text)
+
+    def serialize(self):
+        return {
+            "id": self.Id,
+            "linha": self.Linha,
+            "codigo": self.Codigo,
+            "mensagem": self.Mensagem,
+        }
+
+
+class ImportFicheiro(db.Model):
+    __tablename__ = "ImportFicheiros"
+
+    Id = db.Column("Id", db.Integer, primary_key=True)
+    Tipo = db.Column("Tipo", db.String(20), nullable=False)
+    Digest = db.Column("Digest", db.String(64), nullable=False, index=True)
+    Ficheiro = db.Column("Ficheiro", db.String(255), nullable=False)
+    ImportadoEm = db.Column("ImportadoEm", db.DateTime, default=datetime.utcnow)
+    Metricas = db.Column("Metricas", db.Text)
+
+
+class ImportHash(db.Model):
+    __tablename__ = "ImportHashes"
+
+    Tipo = db.Column("Tipo", db.String(20), primary_key=True)
+    Chave = db.Column("Chave", db.String(50), primary_key=True)
+    Hash = db.Column("Hash", db.String(64), nullable=False)
+
+
+# ===================================================================
+# CATÁLOGO
+# ===================================================================
+
+
+class CatalogoVersao(db.Model):
+    __tablename__ = "CatalogoVersao"
+
+    # linha única (Id = 1), incrementada em cada alteração das fichas
+    Id = db.Column("Id", db.Integer, primary_key=True)
+    Versao = db.Column("Versao", db.BigInteger, nullable=False)
+
+
 # ===================================================================
 # Utilities
 # ===================================================================
@@ -0,0 +1,81 @@
+import base64
+import json
+
+from flask import Blueprint, jsonify, request
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.orm import joinedload
+
+from models import ComponenteUtilizacao, db
+from services.utilizacoes import caminhos
+
+
+LIMITE_PAGINA = 100
+LIMITE_PAGINA_MAX = 1000
+
+
+componentes_bp = Blueprint("componentes", __name__, url_prefix="/api/componentes")
+
+
+def _encode_cursor(profundidade, codigo):
+    return base64.urlsafe_b64encode(json.dumps([profundidade, codigo]).encode()).decode()
+
+
+def _decode_cursor(cursor):
+    try:
+        profundidade, codigo = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return int(profundidade), str(codigo)
+    except Exception as exc:
+        raise ValueError(cursor) from exc
+
+
+@componentes_bp.route("/<codigo>/utilizacoes", methods=["GET"])
+def listar_utilizacoes(codigo):
+    # profundidade=1: só as fichas que usam o componente diretamente
+    profundidade = request.args.get("profundidade", type=int)
+    limit = request.args.get("limit", LIMITE_PAGINA, type=int)
+    limit = min(max(limit, 1), LIMITE_PAGINA_MAX)
+    cursor = request.args.get("cursor")
+
+    filtro = [ComponenteUtilizacao.ComponenteCodigo == codigo]
+    if profundidade:
+        filtro.append(ComponenteUtilizacao.Profundidade <= profundidade)
+
+    total, diretas = db.session.execute(
+        select(func.count(), func.count().filter(ComponenteUtilizacao.Profundidade == 1)).where(*filtro)
+    ).one()
+
+    query = (
+        ComponenteUtilizacao.query.filter(*filtro)
+        .options(joinedload(ComponenteUtilizacao.ficha))
+        .order_by(ComponenteUtilizacao.Profundidade, ComponenteUtilizacao.FichaCodigo)
+    )
+    # paginação por chave sobre (profundidade, ficha), a ordem do índice
+    if cursor:
+        try:
+            chave = _decode_cursor(cursor)
+        except ValueError:
+            return jsonify({"error": "Cursor inválido"}), 400
+        query = query.filter(
+            tuple_(ComponenteUtilizacao.Profundidade, ComponenteUtilizacao.FichaCodigo) > tuple_(*chave)
+        )
+    registos = query.limit(limit + 1).all()
+
+    next_cursor = None
+    if len(registos) > limit:
+        next_cursor = _encode_cursor(registos[limit - 1].Profundidade, registos[limit - 1].FichaCodigo)
+    registos = registos[:limit]
+
+    percursos = caminhos(codigo, registos)
+    utilizacoes = []
+    for registo in registos:
+        utilizacao = registo.serialize()
+        utilizacao["caminho"] = [{"codigo": via, "qtd": qtd} for via, qtd in percursos[registo.FichaCodigo]]
+        utilizacoes.append(utilizacao)
+
+    return jsonify({
+        "componente": codigo,
+        "total": total,
+        "diretas": diretas,
+        "utilizacoes": utilizacoes,
+        "next_cursor": next_cursor,
+    })
@@ -1,14 +1,35 @@
-from flask import Blueprint, jsonify, request
-from models import Alergenio, FichaTecnica, Produto, db
-
-
-def _calcular_preco_linha(ficha: FichaTecnica) -> float:
-    if ficha.preco is not None:
-        return float(ficha.preco or 0)
-
-    qtd = float(ficha.qtd or 0)
-    ppu = float(ficha.ppu or 0)
-    return qtd * ppu
+import base64
+import hashlib
+import json
+
+from flask import Blueprint, current_app, jsonify, request, stream_with_context
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import selectinload
+from models import Alergenio, FichaTotais, Produto, ProdutoAlergenio, ProdutoAlergenioEfetivo, db
+from services.alergenios_efetivos import recompute_alergenios_efetivos
+from services.bulk_upsert import em_lotes
+from services.compressao import etag_variantes
+from services.ficha_totais import calcular_peso_linha, calcular_preco_linha as _calcular_preco_linha, calcular_totais
+from services.fichas_cache import bump_catalog_version, catalog_version, get_fichas, get_referencias, set_loader
+from services.simulacao_precos import simular_precos
+
+
+LIMITE_PAGINA = 100
+LIMITE_PAGINA_MAX = 1000
+LOTE_EXPORTACAO = 500
+
+ORDENACOES = ("codigo", "custo", "-custo", "nome", "-nome")
+VERDADEIRO = ("1", "true", "sim")
+FALSO = ("0", "false", "nao", "não")
+# variante compacta: valores de referência do cabeçalho enviados uma vez por
+# resposta, em listas; a ficha leva o índice (lista -> campo do cabeçalho, coluna)
+REFERENCIAS = {
+    "familias": ("familia", Produto.familia),
+    "subfamilias": ("subfamilia", Produto.subFamilia),
+    "tipos_artigo": ("tipo_artigo", Produto.tipoArtigo),
+    "validades": ("validade", Produto.validade),
+    "temperaturas": ("temperatura", Produto.temperatura),
+}
 
 
 def _serialize_alergeno(alergeno: Alergenio):
@@ -22,32 +43,32 @@ def _serialize_alergeno(alergeno: Alergenio):
     }
 
 
+def _serialize_alergenios_efetivos(produto: Produto):
+    # um alergénio pode chegar por vários componentes: uma entrada com as origens
+    alergenos = {}
+    for efetivo in produto.alergenios_efetivos:
+        if efetivo.AlergenioId not in alergenos:
+            alergenos[efetivo.AlergenioId] = {**_serialize_alergeno(efetivo.alergenio), "origens": []}
+        alergenos[efetivo.AlergenioId]["origens"].append(efetivo.OrigemCodigo)
+    return list(alergenos.values())
+
+
 def _serialize_produto_ficha(produto: Produto):
     linhas = sorted(produto.fichas, key=lambda f: f.ordem or 0)
 
-    composicao = []
-    custo_calculado = 0.0
-    peso_total = 0.0
-
-    for idx, ficha in enumerate(linhas, start=1):
-        preco_linha = _calcular_preco_linha(ficha)
-        peso = float(ficha.peso or ficha.qtd or 0)
-
-        custo_calculado += preco_linha
-        peso_total += peso
-
-        composicao.append(
-            {
-                "ordem": ficha.ordem or idx,
-                "componente_codigo": ficha.componenteCodigo,
-                "componente_nome": ficha.componenteNome,
-                "qtd": float(ficha.qtd or 0),
-                "unidade": ficha.unidade,
-                "ppu": float(ficha.ppu or 0),
-                "preco": preco_linha,
-                "peso": peso,
-            }
-        )
+    composicao = [
+        {
+            "ordem": ficha.ordem or idx,
+            "componente_codigo": ficha.componenteCodigo,
+            "componente_nome": ficha.componenteNome,
+            "qtd": float(ficha.qtd or 0),
+            "unidade": ficha.unidade,
+            "ppu": float(ficha.ppu or 0),
+            "preco": _calcular_preco_linha(ficha),
+            "peso": calcular_peso_linha(ficha),
+        }
+        for idx, ficha in enumerate(linhas, start=1)
+    ]
 
     nome_produto = produto.produto or produto.nomeProdVenda or produto.codigo
 
@@ -69,10 +90,17 @@ def _serialize_produto_ficha(produto: Produto):
         "porcoes": 1,
     }
 
-    custo_registado = custo_calculado
     porcoes = cabecalho.get("porcoes") or 1
     unidade_base = cabecalho.get("unidade_base") or "un"
 
+    # custo e peso guardados em FichaTotais pelas importações; só uma ficha
+    # ainda sem totais os soma aqui
+    totais = produto.totais
+    if totais is None:
+        totais = FichaTotais(**calcular_totais(linhas, porcoes))
+    custo_calculado = totais.CustoCalculado
+    custo_registado = custo_calculado
+
     precos_taxas = None
     if produto.preco:
         precos_taxas = {
@@ -96,12 +124,14 @@ def _serialize_produto_ficha(produto: Produto):
             "diferenca": custo_registado - custo_calculado,
         },
         "totais": {
-            "peso_total": peso_total,
+            "peso_total": totais.PesoTotal,
             "custo_total": custo_registado,
             "unidade_base": unidade_base,
-            "custo_por_unidade_base": custo_registado / porcoes if porcoes else custo_registado,
+            "custo_por_unidade_base": totais.CustoPorUnidadeBase,
         },
+        "custos_multinivel": produto.custo_multinivel.serialize() if produto.custo_multinivel else None,
         "alergenos": [_serialize_alergeno(al) for al in produto.alergenios],
+        "alergenos_efetivos": _serialize_alergenios_efetivos(produto),
         "preparacao_html": None,
         "precos_taxas": precos_taxas,
     }
@@ -110,24 +140,344 @@ def _serialize_produto_ficha(produto: Produto):
 fichas_bp = Blueprint('fichas', __name__, url_prefix='/api')
 
 
+def _query_fichas():
+    # uma query por relação (selectinload) em vez de 3 queries por produto
+    return (
+        Produto.query.filter(Produto.fichas.any())
+        .options(
+            selectinload(Produto.fichas),
+            selectinload(Produto.preco),
+            selectinload(Produto.totais),
+            selectinload(Produto.alergenios),
+            selectinload(Produto.custo_multinivel),
+            selectinload(Produto.alergenios_efetivos).joinedload(ProdutoAlergenioEfetivo.alergenio),
+        )
+        .order_by(Produto.codigo)
+    )
+
+
+def _calcular_referencias():
+    return {
+        nome: db.session.scalars(
+            select(coluna).where(coluna.is_not(None), Produto.fichas.any()).distinct().order_by(coluna)
+        ).all()
+        for nome, (_, coluna) in REFERENCIAS.items()
+    }
+
+
+def _compactar(ficha, ids):
+    # variante compacta: os alergénios e as referências do cabeçalho vão uma vez
+    # nos dicionários da resposta e as fichas levam só os ids
+    cabecalho = dict(ficha["cabecalho"])
+    for nome, (campo, _) in REFERENCIAS.items():
+        valor = cabecalho[campo]
+        # um valor gravado depois de calculada a tabela da versão fica por extenso
+        if valor is not None:
+            cabecalho[campo] = ids[nome].get(valor, valor)
+    return {
+        **ficha,
+        "cabecalho": cabecalho,
+        "alergenos": [alergeno["id"] for alergeno in ficha["alergenos"]],
+        "alergenos_efetivos": [
+            {"id": alergeno["id"], "origens": alergeno["origens"]} for alergeno in ficha["alergenos_efetivos"]
+        ],
+    }
+
+
+def _carregar_fichas(codigos, variante="completa", versao=None):
+    produtos = _query_fichas().filter(Produto.codigo.in_(codigos))
+    fichas = {produto.codigo: _serialize_produto_ficha(produto) for produto in produtos}
+    if variante == "compacta":
+        tabelas = get_referencias(versao, _calcular_referencias)
+        ids = {nome: {valor: i for i, valor in enumerate(valores)} for nome, valores in tabelas.items()}
+        fichas = {codigo: _compactar(ficha, ids) for codigo, ficha in fichas.items()}
+    return fichas
+
+
+set_loader(_carregar_fichas)
+
+
+# As respostas dependem só da versão do catálogo: a ETag (forte) é a versão
+# mais o que identifica o pedido, e um If-None-Match igual dá 304 sem corpo.
+def _resposta(corpo, etag):
+    response = current_app.response_class(corpo, mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def _nao_modificado(etag):
+    # a resposta comprimida tem a ETag com o sufixo da codificação
+    for variante in etag_variantes(etag):
+        if request.if_none_match.contains(variante):
+            response = current_app.response_class(status=304)
+            response.set_etag(variante)
+            return response
+    return None
+
+
+def _dicionarios_compactos(codigos, versao):
+    # só os alergénios usados pelas fichas da resposta (nenhum se nenhuma os tem)
+    ids = set()
+    for chunk in em_lotes(codigos):
+        for model in (ProdutoAlergenio, ProdutoAlergenioEfetivo):
+            ids.update(db.session.scalars(
+                select(model.AlergenioId).where(model.ProdutoCodigo.in_(chunk)).distinct()
+            ))
+    alergenos = Alergenio.query.filter(Alergenio.Id.in_(ids)).order_by(Alergenio.Id) if ids else ()
+    dicionario = "{%s}" % ",".join(
+        f'"{alergeno.Id}":{current_app.json.dumps(_serialize_alergeno(alergeno))}' for alergeno in alergenos
+    )
+    referencias = current_app.json.dumps(get_referencias(versao, _calcular_referencias))
+    return '"alergenos":%s,"referencias":%s' % (dicionario, referencias)
+
+
+def _parse_custo(valor):
+    if valor in (None, ""):
+        return None
+    return float(valor)
+
+
+def _parse_bool(valor):
+    if valor in (None, ""):
+        return None
+    if valor.lower() in VERDADEIRO:
+        return True
+    if valor.lower() in FALSO:
+        return False
+    raise ValueError(valor)
+
+
+def _parse_ids(valores):
+    # ?alergenos=1,7 ou ?alergenos=1&alergenos=7
+    return [int(valor) for texto in valores for valor in texto.split(",") if valor.strip()]
+
+
+def _filtros_lista(args):
+    filtros = []
+    for parametro, coluna in (("familia", Produto.familia), ("subfamilia", Produto.subFamilia)):
+        valores = [valor for valor in args.getlist(parametro) if valor]
+        if len(valores) == 1:
+            filtros.append(coluna == valores[0])
+        elif valores:
+            filtros.append(coluna.in_(valores))
+
+    for parametro, coluna in (("ativo", Produto.ativo), ("descontinuado", Produto.descontinuado), ("menu", Produto.menu)):
+        try:
+            valor = _parse_bool(args.get(parametro))
+        except ValueError:
+            raise ValueError(f"Valor inválido para {parametro}: {args.get(parametro)}")
+        if valor is not None:
+            filtros.append(coluna == valor)
+
+    try:
+        custo_min = _parse_custo(args.get('custo_min'))
+        custo_max = _parse_custo(args.get('custo_max'))
+    except ValueError:
+        raise ValueError("custo_min/custo_max inválidos")
+    if custo_min is not None:
+        filtros.append(FichaTotais.CustoCalculado >= custo_min)
+    if custo_max is not None:
+        filtros.append(FichaTotais.CustoCalculado <= custo_max)
+
+    # alergénios efetivos (os da ficha e os herdados dos componentes):
+    # alergenos = tem todos os indicados, sem_alergenos = não tem nenhum
+    try:
+        incluir = _parse_ids(args.getlist('alergenos'))
+        excluir = _parse_ids(args.getlist('sem_alergenos'))
+    except ValueError:
+        raise ValueError("alergenos/sem_alergenos inválidos")
+    efetivo = ProdutoAlergenioEfetivo
+    for alergenio in incluir:
+        filtros.append(
+            select(efetivo.Id)
+            .where(efetivo.ProdutoCodigo == Produto.codigo, efetivo.AlergenioId == alergenio)
+            .exists()
+        )
+    if excluir:
+        filtros.append(
+            ~select(efetivo.Id)
+            .where(efetivo.ProdutoCodigo == Produto.codigo, efetivo.AlergenioId.in_(excluir))
+            .exists()
+        )
+    return filtros
+
+
+def _encode_cursor(chave, codigo):
+    return base64.urlsafe_b64encode(json.dumps([chave, codigo]).encode()).decode()
+
+
+def _decode_cursor(cursor):
+    try:
+        chave, codigo = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return chave, str(codigo)
+    except Exception as exc:
+        raise ValueError(cursor) from exc
+
+
 @fichas_bp.route('/fichas', methods=['GET'])
 def get_all_fichas():
-    produtos_com_fichas = (
-        Produto.query.outerjoin(FichaTecnica)
-        .filter(FichaTecnica.id.isnot(None))
-        .all()
+    versao = catalog_version()
+    etag = f"v{versao}-lista-{hashlib.sha1(request.query_string).hexdigest()[:12]}"
+    nao_modificado = _nao_modificado(etag)
+    if nao_modificado:
+        return nao_modificado
+
+    ordenacao = request.args.get('sort', 'codigo')
+    if ordenacao not in ORDENACOES:
+        return jsonify({"error": f"Ordenação inválida: {ordenacao}"}), 400
+    # formato=compacto: alergénios e referências do cabeçalho em dicionários, as fichas só com os ids
+    variante = "compacta" if request.args.get('formato') == 'compacto' else "completa"
+    try:
+        filtros = _filtros_lista(request.args)
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    # ordenação e filtros pelos totais guardados e pelas colunas indexadas dos
+    # produtos, sem ler as linhas da composição
+    # o desempate pelo código da mesma tabela da chave: a ordem sai toda do índice
+    if ordenacao.endswith("custo"):
+        codigo, chave = FichaTotais.ProdutoCodigo, FichaTotais.CustoCalculado
+    else:
+        codigo, chave = Produto.codigo, Produto.produto
+    query = (
+        select(codigo, chave)
+        .select_from(Produto)
+        .join(FichaTotais, FichaTotais.ProdutoCodigo == Produto.codigo)
+        .where(*filtros)
     )
+    if ordenacao == "codigo":
+        query = query.order_by(codigo)
+    elif ordenacao.startswith("-"):
+        query = query.order_by(chave.desc(), codigo.desc())
+    else:
+        query = query.order_by(chave, codigo)
+
+    # sem limit/cursor devolve a lista completa (compatível com os clientes atuais)
+    if 'limit' not in request.args and 'cursor' not in request.args:
+        codigos = db.session.scalars(query).all()
+        fichas = get_fichas(codigos, versao, variante)
+        corpo = "[" + ",".join(fichas[c] for c in codigos if c in fichas) + "]"
+        if variante == "compacta":
+            corpo = '{%s,"fichas":%s}' % (_dicionarios_compactos(codigos, versao), corpo)
+        return _resposta(corpo, etag)
+
+    limit = request.args.get('limit', LIMITE_PAGINA, type=int)
+    limit = min(max(limit, 1), LIMITE_PAGINA_MAX)
+    cursor = request.args.get('cursor')
+
+    # paginação por chave: a página seguinte começa depois da última linha
+    # (o código, ou o par custo/código ou nome/código nas outras ordenações)
+    if cursor:
+        if ordenacao == "codigo":
+            query = query.where(codigo > cursor)
+        else:
+            try:
+                valor, ultimo = _decode_cursor(cursor)
+                if ordenacao.endswith("custo"):
+                    valor = float(valor)
+            except (TypeError, ValueError):
+                return jsonify({"error": "Cursor inválido"}), 400
+            if ordenacao.startswith("-"):
+                query = query.where(tuple_(chave, codigo) < tuple_(valor, ultimo))
+            else:
+                query = query.where(tuple_(chave, codigo) > tuple_(valor, ultimo))
+    linhas = db.session.execute(query.limit(limit + 1)).all()
+
+    next_cursor = None
+    if len(linhas) > limit:
+        ultima = linhas[limit - 1]
+        next_cursor = ultima[0] if ordenacao == "codigo" else _encode_cursor(ultima[1], ultima[0])
+    codigos = [linha[0] for linha in linhas[:limit]]
+    fichas = get_fichas(codigos, versao, variante)
+    corpo = '{"fichas":[%s],"next_cursor":%s' % (
+        ",".join(fichas[c] for c in codigos if c in fichas),
+        json.dumps(next_cursor),
+    )
+    if variante == "compacta":
+        corpo += ',' + _dicionarios_compactos(codigos, versao)
+    return _resposta(corpo + "}", etag)
+
+
+@fichas_bp.route('/fichas/batch', methods=['POST'])
+def get_fichas_batch():
+    payload = request.get_json(silent=True) or {}
+    codigos = payload.get("codigos")
+    if not isinstance(codigos, list) or not all(isinstance(c, str) for c in codigos):
+        return jsonify({"error": "Indique a lista de códigos (codigos)"}), 400
+    codigos = list(dict.fromkeys(codigos))
+    if len(codigos) > LIMITE_PAGINA_MAX:
+        return jsonify({"error": f"No máximo {LIMITE_PAGINA_MAX} códigos por pedido"}), 400
+
+    # as fichas em falta na cache são carregadas todas de uma vez (selectinload)
+    fichas = get_fichas(codigos, catalog_version())
+    nao_encontradas = [c for c in codigos if c not in fichas]
+    corpo = '{"fichas":{%s},"nao_encontradas":%s}' % (
+        ",".join(f"{json.dumps(c)}:{fichas.get(c, 'null')}" for c in codigos),
+        json.dumps(nao_encontradas),
+    )
+    return current_app.response_class(corpo, mimetype="application/json")
+
+
+@fichas_bp.route('/fichas/export', methods=['GET'])
+def exportar_fichas():
+    formato = request.args.get('format', 'ndjson')
+    if formato != 'ndjson':
+        return jsonify({"error": f"Formato de exportação não suportado: {formato}"}), 400
+
+    # uma ficha por linha, enviada à medida que cada lote é lido: memória
+    # constante dos dois lados, qualquer que seja o tamanho do catálogo
+    def gerar():
+        versao = catalog_version()
+        cursor = ""
+        while True:
+            codigos = db.session.scalars(
+                select(FichaTotais.ProdutoCodigo)
+                .where(FichaTotais.ProdutoCodigo > cursor)
+                .order_by(FichaTotais.ProdutoCodigo)
+                .limit(LOTE_EXPORTACAO)
+            ).all()
+            if not codigos:
+                break
+            fichas = get_fichas(codigos, versao)
+            yield "".join(fichas[codigo] + "\n" for codigo in codigos if codigo in fichas)
+            cursor = codigos[-1]
+
+    response = current_app.response_class(stream_with_context(gerar()), mimetype="application/x-ndjson")
+    response.headers["Content-Disposition"] = "attachment; filename=fichas.ndjson"
+    return response
+
+
+@fichas_bp.route('/fichas/simulacao-precos', methods=['POST'])
+def simular_variacao_precos():
+    # {"variacoes": {"<componente>": 12, "<componente>": -3}} em percentagem
+    payload = request.get_json(silent=True) or {}
+    variacoes = payload.get("variacoes")
+    if not isinstance(variacoes, dict) or not variacoes:
+        return jsonify({"error": "Indique as variações de preço por componente"}), 400
+
+    try:
+        variacoes = {str(codigo): float(percentagem) / 100 for codigo, percentagem in variacoes.items()}
+    except (TypeError, ValueError):
+        return jsonify({"error": "Variação de preço inválida"}), 400
 
-    return jsonify([_serialize_produto_ficha(produto) for produto in produtos_com_fichas])
+    resultados = simular_precos(variacoes)
+    return jsonify({"fichas_afetadas": len(resultados), "resultados": resultados})
 
 
 @fichas_bp.route('/fichas/<codigo>', methods=['GET'])
 def get_ficha_by_codigo(codigo):
-    produto = Produto.query.filter_by(codigo=codigo).first()
-    if not produto or not produto.fichas:
+    versao = catalog_version()
+    etag = f"v{versao}-{codigo}"
+    nao_modificado = _nao_modificado(etag)
+    if nao_modificado:
+        return nao_modificado
+
+    corpo = get_fichas([codigo], versao).get(codigo)
+    if corpo is None:
         return jsonify({"error": "Ficha não encontrada"}), 404
 
-    return jsonify(_serialize_produto_ficha(produto))
+    return _resposta(corpo, etag)
 
 
 @fichas_bp.route('/fichas/<codigo>/atributos', methods=['PATCH'])
@@ -153,6 +503,7 @@ def atualizar_atributos_tecnicos(codigo):
     if not atualizou:
         return jsonify({"error": "Nenhum atributo para atualizar"}), 400
 
+    bump_catalog_version()
     db.session.commit()
 
     return jsonify(_serialize_produto_ficha(produto))
@@ -176,7 +527,10 @@ def atualizar_alergenios(codigo):
         else []
     )
     produto.alergenios = alergenios
+    db.session.flush()
+    recompute_alergenios_efetivos([codigo])
 
+    bump_catalog_version()
     db.session.commit()
 
     return jsonify(_serialize_produto_ficha(produto))
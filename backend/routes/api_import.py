@@ -1,7 +1,12 @@
 from flask import Blueprint, request, jsonify
 import os
+import shutil
+import uuid
+import zipfile
+from sqlalchemy.exc import OperationalError
 from werkzeug.utils import secure_filename
-from services.import_service import process_import
+from services.import_jobs import get_job, get_job_errors, serialize_job, submit_import
+from services.import_validation import validate_import
 from config import Config
 
 import_bp = Blueprint('import', __name__)
@@ -15,6 +20,9 @@ def upload_file():
     if not tipo:
         return jsonify({"error": "Tipo de importação em falta (produtos, fichas ou precos)"}), 400
 
+    if tipo == 'bundle':
+        return _upload_bundle(request.files.getlist('file'))
+
     file = request.files['file']
     if file.filename == '':
         return jsonify({"error": "Nenhum ficheiro selecionado"}), 400
@@ -23,13 +31,99 @@ def upload_file():
         return jsonify({"error": "Apenas ficheiros Excel"}), 400
 
     filename = secure_filename(file.filename)
-    filepath = os.path.join(Config.UPLOAD_FOLDER, filename)
+    filepath = os.path.join(Config.UPLOAD_FOLDER, f"{uuid.uuid4().hex[:8]}_{filename}")
     file.save(filepath)
 
-    result = process_import(filepath, tipo)
-    status_code = 200 if result.get("status") == "sucesso" else 400
+    # dryRun: só valida, sem escrever na BD, e responde logo com o relatório
+    if request.form.get('dryRun', request.args.get('dryRun', '')).lower() in ('1', 'true', 'sim'):
+        try:
+            result = validate_import(filepath, tipo)
+        finally:
+            os.remove(filepath)
+        return jsonify(result)
+
+    try:
+        job = submit_import(filepath, tipo, ficheiro=filename)
+    except OperationalError:
+        # sem trabalho registado o ficheiro não fica esquecido em imports/
+        os.remove(filepath)
+        raise
+
+    return jsonify({
+        "message": "Importação em fila",
+        "job": job.serialize()
+    }), 202
+
+
+def _save_upload(stream, filename):
+    filepath = os.path.join(Config.UPLOAD_FOLDER, f"{uuid.uuid4().hex[:8]}_{secure_filename(filename)}")
+    with open(filepath, 'wb') as destino:
+        shutil.copyfileobj(stream, destino)
+    return filepath
+
+
+# Pacote produtos + fichas + preços: um zip ou vários ficheiros no mesmo pedido
+def _upload_bundle(files):
+    files = [f for f in files if f.filename]
+    if not files:
+        return jsonify({"error": "Nenhum ficheiro selecionado"}), 400
+
+    paths = []
+    for file in files:
+        if file.filename.lower().endswith('.zip'):
+            try:
+                with zipfile.ZipFile(file.stream) as pacote:
+                    for membro in pacote.infolist():
+                        nome = os.path.basename(membro.filename)
+                        if membro.is_dir() or nome.startswith('.') or not nome.lower().endswith('.xlsx'):
+                            continue
+                        with pacote.open(membro) as origem:
+                            paths.append(_save_upload(origem, nome))
+            except zipfile.BadZipFile:
+                return jsonify({"error": f"Ficheiro zip inválido: {file.filename}"}), 400
+        elif file.filename.lower().endswith(('.xlsx', '.xls')):
+            paths.append(_save_upload(file.stream, file.filename))
+        else:
+            return jsonify({"error": "Apenas ficheiros Excel ou zip"}), 400
+
+    if not paths:
+        return jsonify({"error": "O pacote não tem ficheiros Excel"}), 400
+
+    try:
+        job = submit_import(paths, 'bundle', ficheiro=", ".join(secure_filename(f.filename) for f in files)[:255])
+    except OperationalError:
+        for path in paths:
+            os.remove(path)
+        raise
+
+    return jsonify({
+        "message": "Importação em fila",
+        "job": job.serialize()
+    }), 202
+
+
+@import_bp.route('/import/jobs/<job_id>', methods=['GET'])
+def get_import_job(job_id):
+    job = get_job(job_id)
+    if not job:
+        return jsonify({"error": "Importação não encontrada"}), 404
+
+    return jsonify(serialize_job(job))
+
+
+@import_bp.route('/import/<job_id>/erros', methods=['GET'])
+def get_import_errors(job_id):
+    job = get_job(job_id)
+    if not job:
+        return jsonify({"error": "Importação não encontrada"}), 404
+
+    after = request.args.get('page', type=int)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+    erros, next_page = get_job_errors(job_id, after=after, limit=limit)
 
     return jsonify({
-        "message": "Importação concluída",
-        "detalhes": result
-    }), status_code
+        "importId": job_id,
+        "total": job.NumErros or 0,
+        "erros": [erro.serialize() for erro in erros],
+        "nextPage": next_page
+    })
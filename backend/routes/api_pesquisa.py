@@ -0,0 +1,34 @@
+from flask import Blueprint, jsonify, request
+
+from services.pesquisa import pesquisa_disponivel, pesquisar
+
+
+LIMITE_PAGINA = 20
+LIMITE_PAGINA_MAX = 200
+
+
+pesquisa_bp = Blueprint("pesquisa", __name__, url_prefix="/api/pesquisa")
+
+
+@pesquisa_bp.route("", methods=["GET"])
+def pesquisar_produtos():
+    if not pesquisa_disponivel():
+        return jsonify({"error": "Pesquisa disponível apenas com SQLite"}), 501
+
+    termos = (request.args.get("q") or "").strip()
+    if not termos:
+        return jsonify({"error": "Indique o texto a pesquisar (q)"}), 400
+
+    page = max(request.args.get("page", 1, type=int), 1)
+    limit = min(max(request.args.get("limit", LIMITE_PAGINA, type=int), 1), LIMITE_PAGINA_MAX)
+    # fichas=1: só produtos com ficha técnica
+    so_fichas = request.args.get("fichas") in ("1", "true")
+
+    total, resultados = pesquisar(termos, limit, (page - 1) * limit, so_fichas)
+    return jsonify({
+        "q": termos,
+        "total": total,
+        "page": page,
+        "resultados": resultados,
+        "nextPage": page + 1 if page * limit < total else None,
+    })
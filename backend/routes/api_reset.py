@@ -1,5 +1,7 @@
 from flask import Blueprint, jsonify
 from models import db
+from services.fichas_cache import clear_cache
+from services.pesquisa import init_pesquisa
 from config import Config
 import os
 import shutil
@@ -14,8 +16,9 @@ def reset_database():
         db.engine.dispose()
 
         db_path = Config.SQLALCHEMY_DATABASE_URI.replace("sqlite:///", "", 1)
-        if db_path and os.path.exists(db_path):
-            os.remove(db_path)
+        for path in (db_path, f"{db_path}-wal", f"{db_path}-shm"):
+            if db_path and os.path.exists(path):
+                os.remove(path)
 
         images_path = os.path.join(os.path.dirname(__file__), '..', 'databases', 'images')
         uploads_path = Config.UPLOAD_FOLDER
@@ -30,6 +33,8 @@ def reset_database():
                         shutil.rmtree(target)
 
         db.create_all()
+        init_pesquisa()
+        clear_cache()
 
         return jsonify({"message": "Base de dados apagada e recriada! Tudo limpo."}), 200
     except Exception as e:
@@ -0,0 +1,73 @@
+from sqlalchemy import delete, select
+
+from models import FichaTecnica, ProdutoAlergenio, ProdutoAlergenioEfetivo, db
+from services.bulk_upsert import BATCH_SIZE, bulk_insert, em_lotes
+from services.grafo_fichas import ascendentes
+
+
+# Recalcula os alergénios efetivos dos produtos indicados e de todas as fichas
+# que os usam, na transação corrente. Os componentes fora desse conjunto não
+# mudaram: os seus alergénios efetivos são lidos da própria tabela.
+def recompute_alergenios_efetivos(codigos, batch_size=BATCH_SIZE):
+    afetados = ascendentes(codigos, batch_size)
+    fichas = FichaTecnica.__table__
+    diretos_table = ProdutoAlergenio.__table__
+    efetivos_table = ProdutoAlergenioEfetivo.__table__
+
+    componentes, diretos = {}, {}
+    for chunk in em_lotes(afetados, batch_size):
+        query = select(fichas.c.codigo, fichas.c.componenteCodigo).where(fichas.c.codigo.in_(chunk))
+        for codigo, componente in db.session.execute(query):
+            componentes.setdefault(codigo, set()).add(componente)
+        query = select(diretos_table.c.ProdutoCodigo, diretos_table.c.AlergenioId).where(
+            diretos_table.c.ProdutoCodigo.in_(chunk)
+        )
+        for codigo, alergenio in db.session.execute(query):
+            diretos.setdefault(codigo, set()).add(alergenio)
+
+    externos = {}
+    fora = {c for subs in componentes.values() for c in subs} - afetados
+    for chunk in em_lotes(fora, batch_size):
+        query = select(efetivos_table.c.ProdutoCodigo, efetivos_table.c.AlergenioId).where(
+            efetivos_table.c.ProdutoCodigo.in_(chunk)
+        )
+        for codigo, alergenio in db.session.execute(query):
+            externos.setdefault(codigo, set()).add(alergenio)
+
+    # ponto fixo: os conjuntos só crescem, por isso termina mesmo com ciclos
+    fechos = {codigo: set(diretos.get(codigo, ())) for codigo in afetados}
+    mudou = True
+    while mudou:
+        mudou = False
+        for codigo in afetados:
+            fecho = fechos[codigo]
+            antes = len(fecho)
+            for componente in componentes.get(codigo, ()):
+                fecho |= fechos[componente] if componente in fechos else externos.get(componente, set())
+            mudou = mudou or len(fecho) != antes
+
+    linhas = []
+    for codigo in afetados:
+        for alergenio in diretos.get(codigo, ()):
+            linhas.append({"ProdutoCodigo": codigo, "AlergenioId": alergenio, "OrigemCodigo": codigo})
+        for componente in componentes.get(codigo, ()):
+            if componente == codigo:
+                continue
+            herdados = fechos[componente] if componente in fechos else externos.get(componente, ())
+            for alergenio in herdados:
+                linhas.append({"ProdutoCodigo": codigo, "AlergenioId": alergenio, "OrigemCodigo": componente})
+
+    for chunk in em_lotes(afetados, batch_size):
+        db.session.execute(delete(efetivos_table).where(efetivos_table.c.ProdutoCodigo.in_(chunk)))
+    bulk_insert(efetivos_table, linhas, batch_size)
+
+
+def backfill_alergenios_efetivos():
+    # bases de dados com alergénios atribuídos antes desta tabela
+    vazia = db.session.execute(select(ProdutoAlergenioEfetivo.Id).limit(1)).first() is None
+    if not vazia:
+        return
+    codigos = db.session.scalars(select(ProdutoAlergenio.ProdutoCodigo).distinct()).all()
+    if codigos:
+        recompute_alergenios_efetivos(codigos)
+        db.session.commit()
@@ -0,0 +1,213 @@
+import csv
+import io
+from collections import defaultdict
+
+from sqlalchemy import Numeric, bindparam, delete, insert, select, update
+
+from models import db
+
+
+BATCH_SIZE = 500
+
+CRIADO = "criado"
+ATUALIZADO = "atualizado"
+INALTERADO = "inalterado"
+
+
+def _normalize(column, value):
+    if value is None:
+        return None
+    if isinstance(column.type, Numeric):
+        try:
+            return round(float(value), column.type.scale or 4)
+        except (TypeError, ValueError):
+            return value
+    return value
+
+
+# Upsert por chave lógica única: lê os existentes em blocos e acumula as
+# escritas até flush(), que as envia em lotes executemany.
+class BulkUpsert:
+    def __init__(self, model, key, batch_size=BATCH_SIZE):
+        self.table = model.__table__
+        self.key = key
+        self.batch_size = batch_size
+        self._rows = {}
+        self._missing = set()
+        self._inserts = {}
+        self._updates = {}
+
+    def prefetch(self, codes):
+        pending = [c for c in set(codes) if c not in self._rows and c not in self._missing]
+        key_column = self.table.c[self.key]
+
+        for start in range(0, len(pending), self.batch_size):
+            chunk = pending[start:start + self.batch_size]
+            found = db.session.execute(select(self.table).where(key_column.in_(chunk))).mappings()
+            for row in found:
+                self._rows[row[self.key]] = dict(row)
+            self._missing.update(c for c in chunk if c not in self._rows)
+
+    def get(self, code):
+        if code not in self._rows and code not in self._missing:
+            self.prefetch([code])
+        return self._rows.get(code)
+
+    def upsert(self, code, values):
+        values = {k: v for k, v in values.items() if k in self.table.c and k != self.key}
+        current = self.get(code)
+
+        if current is None:
+            row = {self.key: code, **values}
+            self._inserts[code] = row
+            self._rows[code] = dict(row)
+            self._missing.discard(code)
+            return CRIADO
+
+        if code in self._inserts:
+            self._inserts[code].update(values)
+            current.update(values)
+            return ATUALIZADO
+
+        changed = {
+            field: value
+            for field, value in values.items()
+            if _normalize(self.table.c[field], value) != _normalize(self.table.c[field], current.get(field))
+        }
+        if not changed:
+            return INALTERADO
+
+        self._updates.setdefault(code, {}).update(changed)
+        current.update(changed)
+        return ATUALIZADO
+
+    def flush(self):
+        bulk_insert(self.table, self._inserts.values(), self.batch_size)
+
+        key_param = f"_{self.key}"
+        statement = update(self.table).where(self.table.c[self.key] == bindparam(key_param))
+        updates = ({key_param: code, **values} for code, values in self._updates.items())
+        for keys, rows in _group_by_keys(updates).items():
+            for start in range(0, len(rows), self.batch_size):
+                db.session.execute(statement, rows[start:start + self.batch_size])
+
+        self._inserts.clear()
+        self._updates.clear()
+
+
+# Blocos de até batch_size códigos, para os IN (...) não excederem o limite
+# de parâmetros do motor
+def em_lotes(codigos, batch_size=BATCH_SIZE):
+    codigos = list(codigos)
+    for start in range(0, len(codigos), batch_size):
+        yield codigos[start:start + batch_size]
+
+
+def _group_by_keys(rows):
+    # executemany exige o mesmo conjunto de colunas em todos os parâmetros
+    groups = defaultdict(list)
+    for row in rows:
+        groups[frozenset(row)].append(row)
+    return groups
+
+
+def _copy_supported():
+    dialect = db.session.get_bind().dialect
+    return dialect.name == "postgresql" and dialect.driver == "psycopg2"
+
+
+# Inserção em massa com o mecanismo mais rápido do motor ativo: COPY no
+# PostgreSQL (psycopg2), INSERT executemany em lotes nos restantes
+def bulk_insert(table, rows, batch_size=BATCH_SIZE):
+    copy = _copy_supported()
+    for keys, group in _group_by_keys(rows).items():
+        if copy:
+            _copy_rows(table, group)
+            continue
+        for start in range(0, len(group), batch_size):
+            db.session.execute(insert(table), group[start:start + batch_size])
+
+
+def _copy_rows(table, rows):
+    # o COPY não aplica os defaults definidos em Python (datas, booleanos, ...)
+    defaults = {
+        column.name: column.default
+        for column in table.c
+        if column.default is not None and column.name not in rows[0]
+    }
+    columns = list(rows[0]) + list(defaults)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        valores = [row[c] for c in rows[0]]
+        valores += [d.arg(None) if d.is_callable else d.arg for d in defaults.values()]
+        writer.writerow(["\\N" if v is None else v for v in valores])
+    buffer.seek(0)
+
+    preparer = db.session.get_bind().dialect.identifier_preparer
+    sql = "COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL '\\N')".format(
+        preparer.format_table(table), ", ".join(preparer.quote(c) for c in columns)
+    )
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(sql, buffer)
+    finally:
+        cursor.close()
+
+
+# Sincroniza linhas-filho agrupadas por pai (ex.: composição de cada ficha):
+# groups = {pai: {filho: valores}}. Aplica apenas inserts, updates e deletes
+# face ao que já existe, em lotes.
+def sync_groups(model, parent_key, child_key, groups, delete_missing=True, batch_size=BATCH_SIZE):
+    table = model.__table__
+    parents = list(groups)
+    existing = {}
+    for start in range(0, len(parents), batch_size):
+        chunk = parents[start:start + batch_size]
+        for row in db.session.execute(select(table).where(table.c[parent_key].in_(chunk))).mappings():
+            existing[(row[parent_key], row[child_key])] = row
+
+    inserts, updates, wanted, touched = [], [], set(), set()
+    for parent, children in groups.items():
+        for child, values in children.items():
+            key = (parent, child)
+            wanted.add(key)
+            current = existing.get(key)
+            if current is None:
+                inserts.append({parent_key: parent, child_key: child, **values})
+                touched.add(parent)
+                continue
+            changed = {
+                field: value
+                for field, value in values.items()
+                if _normalize(table.c[field], value) != _normalize(table.c[field], current[field])
+            }
+            if changed:
+                updates.append({"_id": current["id"], **changed})
+                touched.add(parent)
+
+    deletes = []
+    if delete_missing:
+        for (parent, child), row in existing.items():
+            if (parent, child) not in wanted:
+                deletes.append(row["id"])
+                touched.add(parent)
+
+    for start in range(0, len(deletes), batch_size):
+        db.session.execute(delete(table).where(table.c.id.in_(deletes[start:start + batch_size])))
+
+    statement = update(table).where(table.c.id == bindparam("_id"))
+    for keys, rows in _group_by_keys(updates).items():
+        for start in range(0, len(rows), batch_size):
+            db.session.execute(statement, rows[start:start + batch_size])
+
+    bulk_insert(table, inserts, batch_size)
+
+    return {
+        "inseridas": len(inserts),
+        "atualizadas": len(updates),
+        "removidas": len(deletes),
+        "existentes": {parent for parent, _ in existing},
+        "alterados": touched,
+    }
@@ -0,0 +1,50 @@
+import gzip
+import zlib
+
+from flask import request
+
+
+CODIFICACOES = ("gzip", "deflate")
+TIPOS = ("application/json",)
+
+
+def etag_variantes(etag):
+    # cada codificação é outra representação: a ETag forte leva um sufixo
+    return [etag] + [f"{etag}-{codificacao}" for codificacao in CODIFICACOES]
+
+
+def _comprimir(corpo, codificacao, nivel):
+    if codificacao == "gzip":
+        return gzip.compress(corpo, compresslevel=nivel)
+    return zlib.compress(corpo, nivel)
+
+
+# Comprime as respostas JSON com gzip ou deflate, conforme o Accept-Encoding do
+# pedido. Respostas em streaming (exportação) seguem sem compressão.
+def init_compressao(app):
+    @app.after_request
+    def _comprimir_resposta(response):
+        if (
+            response.status_code != 200
+            or response.direct_passthrough
+            or response.is_streamed
+            or response.mimetype not in TIPOS
+            or "Content-Encoding" in response.headers
+        ):
+            return response
+
+        codificacao = request.accept_encodings.best_match(CODIFICACOES)
+        response.vary.add("Accept-Encoding")
+        if not codificacao:
+            return response
+
+        corpo = response.get_data()
+        if len(corpo) < app.config.get("RESPONSE_COMPRESS_MIN_SIZE", 1024):
+            return response
+
+        response.set_data(_comprimir(corpo, codificacao, app.config.get("RESPONSE_COMPRESS_LEVEL", 6)))
+        response.headers["Content-Encoding"] = codificacao
+        etag, fraca = response.get_etag()
+        if etag:
+            response.set_etag(f"{etag}-{codificacao}", weak=fraca)
+        return response
@@ -0,0 +1,131 @@
+import json
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import Float, delete, select, type_coerce
+
+from models import FichaCustoMultinivel, FichaTecnica, FichaTotais, db
+from services.bulk_upsert import BATCH_SIZE, bulk_insert
+
+
+# Só as linhas cujo componente tem ficha própria (as arestas do grafo), já como
+# (componente, qtd, custo da linha); o custo das restantes linhas já está
+# somado em FichaTotais.
+def _carregar_grafo():
+    fichas = FichaTecnica.__table__
+    totais = FichaTotais.__table__
+    custos = dict(db.session.execute(select(totais.c.ProdutoCodigo, totais.c.CustoCalculado)).all())
+    # Float em vez de Numeric: sem Decimal por linha
+    valores = [type_coerce(fichas.c[c], Float) for c in ("preco", "qtd", "ppu")]
+    query = (
+        select(fichas.c.codigo, fichas.c.componenteCodigo, *valores)
+        .join(totais, totais.c.ProdutoCodigo == fichas.c.componenteCodigo)
+        .order_by(fichas.c.id)
+    )
+    arestas = {}
+    for codigo, componente, preco, qtd, ppu in db.session.execute(query):
+        # arredondados como Numeric(12, 4), para coincidir com calcular_preco_linha
+        qtd = round(qtd or 0.0, 4)
+        custo_linha = round(preco, 4) if preco is not None else qtd * round(ppu or 0.0, 4)
+        arestas.setdefault(codigo, []).append((componente, qtd, custo_linha))
+    return custos, arestas
+
+
+# Ordem topológica das fichas (sub-fichas primeiro). As que ficam de fora fazem
+# parte de um ciclo ou dependem de uma ficha que faz.
+def _ordenar(custos, arestas):
+    pais, pendentes = {}, {}
+    for codigo in custos:
+        subs = {componente for componente, _, _ in arestas.get(codigo, ())}
+        pendentes[codigo] = len(subs)
+        for sub in subs:
+            pais.setdefault(sub, []).append(codigo)
+
+    fila = deque(codigo for codigo, n in pendentes.items() if n == 0)
+    ordem = []
+    while fila:
+        codigo = fila.popleft()
+        ordem.append(codigo)
+        for pai in pais.get(codigo, ()):
+            pendentes[pai] -= 1
+            if pendentes[pai] == 0:
+                fila.append(pai)
+
+    resolvidas = set(ordem)
+    return ordem, sorted(codigo for codigo in custos if codigo not in resolvidas)
+
+
+def _avaliar(custo_linhas, arestas, custos):
+    niveis = [custo_linhas]
+    for componente, qtd, custo_linha in arestas:
+        sub = custos.get(componente)
+        # sub-ficha sem custo (ou ainda por resolver num ciclo): fica o custo da linha
+        if sub is None or not sub[0]:
+            continue
+
+        # a linha expandida sai do 1.º nível; uma ficha rende uma unidade base (porcoes = 1)
+        niveis[0] -= custo_linha
+        for nivel, custo in enumerate(sub[1], start=1):
+            if nivel == len(niveis):
+                niveis.append(0.0)
+            niveis[nivel] += qtd * custo
+    return sum(niveis), niveis
+
+
+# custos = {codigo: custo das linhas da ficha}, arestas = {codigo: [(componente,
+# qtd, custo da linha)]} -> {codigo: (custo, niveis, ciclo)}
+def calcular_custos_multinivel(custos, arestas):
+    ordem, ciclicas = _ordenar(custos, arestas)
+    calculados = {}
+    for codigo in ordem:
+        calculados[codigo] = _avaliar(custos[codigo], arestas.get(codigo, ()), calculados)
+
+    # nas fichas com ciclo só as sub-fichas resolvidas são expandidas
+    resolvidas = dict(calculados)
+    resultado = {codigo: (custo, niveis, False) for codigo, (custo, niveis) in calculados.items()}
+    for codigo in ciclicas:
+        custo, niveis = _avaliar(custos[codigo], arestas.get(codigo, ()), resolvidas)
+        resultado[codigo] = (custo, niveis, True)
+    return resultado
+
+
+# Recalcula o catálogo inteiro na transação corrente (depois dos totais de cada
+# ficha); só grava as fichas cujo resultado mudou.
+def recompute_custos_multinivel(batch_size=BATCH_SIZE):
+    calculados = calcular_custos_multinivel(*_carregar_grafo())
+
+    table = FichaCustoMultinivel.__table__
+    existentes = {
+        linha.ProdutoCodigo: (linha.CustoTotal, linha.Niveis, linha.Ciclo)
+        for linha in db.session.execute(select(table.c.ProdutoCodigo, table.c.CustoTotal, table.c.Niveis, table.c.Ciclo))
+    }
+
+    agora = datetime.utcnow()
+    novos = []
+    for codigo, (custo, niveis, ciclo) in calculados.items():
+        niveis_json = json.dumps(niveis)
+        if existentes.get(codigo) == (custo, niveis_json, ciclo):
+            continue
+        novos.append({
+            "ProdutoCodigo": codigo,
+            "CustoTotal": custo,
+            "Profundidade": len(niveis),
+            "Ciclo": ciclo,
+            "Niveis": niveis_json,
+            "AtualizadoEm": agora,
+        })
+
+    obsoletos = [codigo for codigo in existentes if codigo not in calculados]
+    obsoletos.extend(linha["ProdutoCodigo"] for linha in novos if linha["ProdutoCodigo"] in existentes)
+    for start in range(0, len(obsoletos), batch_size):
+        db.session.execute(delete(table).where(table.c.ProdutoCodigo.in_(obsoletos[start:start + batch_size])))
+    bulk_insert(table, novos, batch_size)
+    return len(novos)
+
+
+def backfill_custos_multinivel():
+    # bases de dados com fichas anteriores a esta tabela
+    vazia = db.session.execute(select(FichaCustoMultinivel.ProdutoCodigo).limit(1)).first() is None
+    if vazia and db.session.execute(select(FichaTecnica.id).limit(1)).first() is not None:
+        recompute_custos_multinivel()
+        db.session.commit()
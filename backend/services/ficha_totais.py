@@ -0,0 +1,73 @@
+from datetime import datetime
+
+from sqlalchemy import delete, select
+
+from models import FichaTecnica, FichaTotais, db
+from services.bulk_upsert import BATCH_SIZE, bulk_insert
+
+
+def calcular_preco_linha(ficha) -> float:
+    if ficha.preco is not None:
+        return float(ficha.preco or 0)
+
+    qtd = float(ficha.qtd or 0)
+    ppu = float(ficha.ppu or 0)
+    return qtd * ppu
+
+
+def calcular_peso_linha(ficha) -> float:
+    return float(ficha.peso or ficha.qtd or 0)
+
+
+def calcular_totais(linhas, porcoes=1):
+    # mesma ordem de soma que a composição apresentada (por "ordem")
+    linhas = sorted(linhas, key=lambda f: f.ordem or 0)
+    custo = 0.0
+    peso = 0.0
+    for ficha in linhas:
+        custo += calcular_preco_linha(ficha)
+        peso += calcular_peso_linha(ficha)
+
+    return {
+        "NumLinhas": len(linhas),
+        "CustoCalculado": custo,
+        "PesoTotal": peso,
+        "CustoPorUnidadeBase": custo / porcoes if porcoes else custo,
+    }
+
+
+# Recalcula os totais das fichas indicadas a partir das linhas atuais (na
+# transação corrente); fichas sem linhas deixam de ter totais.
+def recompute_totais(codigos, batch_size=BATCH_SIZE):
+    codigos = list(codigos)
+    table = FichaTotais.__table__
+    linhas_table = FichaTecnica.__table__
+    colunas = [linhas_table.c[c] for c in ("codigo", "ordem", "preco", "qtd", "ppu", "peso")]
+
+    for start in range(0, len(codigos), batch_size):
+        chunk = codigos[start:start + batch_size]
+        linhas = {}
+        query = select(*colunas).where(linhas_table.c.codigo.in_(chunk)).order_by(linhas_table.c.id)
+        for linha in db.session.execute(query):
+            linhas.setdefault(linha.codigo, []).append(linha)
+
+        agora = datetime.utcnow()
+        db.session.execute(delete(table).where(table.c.ProdutoCodigo.in_(chunk)))
+        bulk_insert(table, [
+            {"ProdutoCodigo": codigo, **calcular_totais(linhas[codigo]), "AtualizadoEm": agora}
+            for codigo in chunk
+            if codigo in linhas
+        ])
+
+
+def backfill_totais():
+    # fichas de bases de dados anteriores à tabela de totais
+    table = FichaTotais.__table__
+    em_falta = db.session.scalars(
+        select(FichaTecnica.codigo)
+        .distinct()
+        .where(~select(table.c.ProdutoCodigo).where(table.c.ProdutoCodigo == FichaTecnica.codigo).exists())
+    ).all()
+    if em_falta:
+        recompute_totais(em_falta)
+        db.session.commit()
@@ -0,0 +1,117 @@
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import insert, select, update
+
+from models import CatalogoVersao, Produto, db
+
+
+BATCH_SIZE = 500
+
+# Cache em memória das fichas já serializadas (JSON), por (código, versão do
+# catálogo, variante). Uma versão nova torna todas as entradas anteriores obsoletas.
+_lock = threading.Lock()
+_entradas = OrderedDict()
+_versao_atual = None
+_loader = None
+# Tabelas de referência da variante compacta, por versão do catálogo (só as
+# mais recentes): as fichas em cache e as respostas usam os mesmos ids
+_referencias = OrderedDict()
+REFERENCIAS_VERSOES = 4
+
+
+def set_loader(loader):
+    # loader(codigos, variante, versao) -> {codigo: ficha serializada}; definido pela rota das fichas
+    global _loader
+    _loader = loader
+
+
+def catalog_version():
+    versao = db.session.execute(select(CatalogoVersao.Versao).where(CatalogoVersao.Id == 1)).scalar()
+    return versao or 0
+
+
+def bump_catalog_version():
+    # na transação corrente: a versão nova só é visível com o commit das alterações
+    table = CatalogoVersao.__table__
+    atualizadas = db.session.execute(
+        update(table).where(table.c.Id == 1).values(Versao=table.c.Versao + 1)
+    ).rowcount
+    if not atualizadas:
+        # começa no instante atual para não repetir versões depois de um reset
+        db.session.execute(insert(table).values(Id=1, Versao=int(time.time())))
+
+
+def clear_cache():
+    global _versao_atual
+    with _lock:
+        _entradas.clear()
+        _referencias.clear()
+        _versao_atual = None
+
+
+def get_fichas(codigos, versao, variante="completa"):
+    global _versao_atual
+    encontradas, em_falta = {}, []
+    with _lock:
+        if _versao_atual is None or versao > _versao_atual:
+            _entradas.clear()
+            _versao_atual = versao
+        for codigo in codigos:
+            corpo = _entradas.get((codigo, versao, variante))
+            if corpo is None:
+                em_falta.append(codigo)
+            else:
+                _entradas.move_to_end((codigo, versao, variante))
+                encontradas[codigo] = corpo
+
+    if not em_falta:
+        return encontradas
+
+    carregadas = {codigo: current_app.json.dumps(ficha) for codigo, ficha in _loader(em_falta, variante, versao).items()}
+    encontradas.update(carregadas)
+
+    limite = current_app.config.get("FICHAS_CACHE_SIZE", 20000)
+    with _lock:
+        # um pedido que leu uma versão já ultrapassada não alimenta a cache
+        if versao == _versao_atual:
+            for codigo, corpo in carregadas.items():
+                _entradas[(codigo, versao, variante)] = corpo
+            while len(_entradas) > limite:
+                _entradas.popitem(last=False)
+    return encontradas
+
+
+def get_referencias(versao, calcular):
+    with _lock:
+        tabelas = _referencias.get(versao)
+    if tabelas is not None:
+        return tabelas
+
+    tabelas = calcular()
+    with _lock:
+        # outro pedido pode ter calculado a mesma versão entretanto: fica a primeira
+        tabelas = _referencias.setdefault(versao, tabelas)
+        while len(_referencias) > REFERENCIAS_VERSOES:
+            _referencias.popitem(last=False)
+    return tabelas
+
+
+def warm_cache(batch_size=BATCH_SIZE):
+    if _loader is None:
+        return
+    versao = catalog_version()
+    cursor = ""
+    while True:
+        codigos = db.session.scalars(
+            select(Produto.codigo)
+            .where(Produto.codigo > cursor, Produto.fichas.any())
+            .order_by(Produto.codigo)
+            .limit(batch_size)
+        ).all()
+        if not codigos:
+            break
+        get_fichas(codigos, versao)
+        cursor = codigos[-1]
@@ -0,0 +1,45 @@
+import hashlib
+
+import pandas as pd
+from sqlalchemy import delete, select
+
+from models import ImportHash, db
+from services.bulk_upsert import bulk_insert
+
+
+BATCH_SIZE = 500
+
+
+def row_hashes(frame):
+    # o conjunto de colunas entra no hash: uma coluna nova/removida obriga a reescrever
+    columns = hashlib.sha1("\x1f".join(frame.columns).encode("utf-8")).hexdigest()[:8]
+    values = pd.util.hash_pandas_object(frame, index=False).astype(str)
+    return columns + ":" + values
+
+
+def group_hash(hashes):
+    return hashlib.sha1("|".join(hashes).encode("utf-8")).hexdigest()
+
+
+def load_hashes(tipo, keys):
+    keys = list(set(keys))
+    table = ImportHash.__table__
+    found = {}
+    for start in range(0, len(keys), BATCH_SIZE):
+        chunk = keys[start:start + BATCH_SIZE]
+        rows = db.session.execute(
+            select(table.c.Chave, table.c.Hash).where(table.c.Tipo == tipo, table.c.Chave.in_(chunk))
+        )
+        found.update(rows.all())
+    return found
+
+
+def store_hashes(tipo, hashes):
+    if not hashes:
+        return
+    table = ImportHash.__table__
+    keys = list(hashes)
+    for start in range(0, len(keys), BATCH_SIZE):
+        chunk = keys[start:start + BATCH_SIZE]
+        db.session.execute(delete(table).where(table.c.Tipo == tipo, table.c.Chave.in_(chunk)))
+    bulk_insert(table, [{"Tipo": tipo, "Chave": key, "Hash": hashes[key]} for key in keys])
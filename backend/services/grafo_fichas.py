@@ -0,0 +1,20 @@
+from sqlalchemy import select
+
+from models import FichaTecnica, db
+from services.bulk_upsert import BATCH_SIZE, em_lotes
+
+
+# Fichas que usam (direta ou indiretamente) algum dos códigos, incluindo os
+# próprios códigos: um nível do grafo por consulta, pelo índice de componenteCodigo
+def ascendentes(codigos, batch_size=BATCH_SIZE):
+    fichas = FichaTecnica.__table__
+    vistos = set(codigos)
+    fronteira = set(codigos)
+    while fronteira:
+        seguinte = set()
+        for chunk in em_lotes(fronteira, batch_size):
+            query = select(fichas.c.codigo).distinct().where(fichas.c.componenteCodigo.in_(chunk))
+            seguinte.update(db.session.scalars(query))
+        fronteira = seguinte - vistos
+        vistos |= fronteira
+    return vistos
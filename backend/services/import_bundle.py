@@ -0,0 +1,216 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from models import ImportFicheiro, db
+from services.fichas_cache import bump_catalog_version
+from services.import_metrics import ImportMetrics
+from services.import_service import (
+    CHUNK_ROWS,
+    IMPORTERS,
+    _archive,
+    _archive_name,
+    _catalog_changed,
+    _coerce_frame,
+    _file_digest,
+    _iter_chunks,
+    _key_fields,
+    _new_result,
+    _open_sheet,
+    _read_header,
+    _store_errors,
+    _validate_headers,
+    _validate_keys,
+)
+
+
+# ordem de aplicação: os produtos existem antes das fichas e dos preços que os
+# referem, por isso não há produtos provisórios para códigos do próprio pacote
+ORDEM = ("produtos", "fichas", "precos")
+
+CONTADORES = ("produtos", "fichas", "ingredientes", "precos", "criados", "atualizados", "inalterados")
+
+
+def _detect_tipo(columns):
+    for tipo in ORDEM:
+        if not _validate_headers(columns, IMPORTERS[tipo]["required"]):
+            return tipo
+    return None
+
+
+# Lê só o cabeçalho para saber o tipo da folha; os dados são lidos depois, à
+# medida que são escritos
+def _detect_file(file_path):
+    parte = {"ficheiro": file_path, "tipo": None, "erros": []}
+    workbook, sheet, file_errors = _open_sheet(file_path)
+    if file_errors:
+        parte["erros"] = file_errors
+        return parte
+
+    try:
+        columns, _ = _read_header(sheet)
+    finally:
+        workbook.close()
+    parte["tipo"] = _detect_tipo(columns)
+    if parte["tipo"] is None:
+        parte["erros"] = [{"codigo": "E011", "mensagem": "Conjunto de cabeçalhos não reconhecido"}]
+    return parte
+
+
+def _iter_frames(parte, chunk_rows):
+    spec = IMPORTERS[parte["tipo"]]
+    workbook, sheet, _ = _open_sheet(parte["ficheiro"])
+    try:
+        columns, rows = _read_header(sheet)
+        for chunk in _iter_chunks(rows, columns, spec["field_types"], chunk_rows, spec["group_by"]):
+            frame = _coerce_frame(chunk, spec["field_types"], _key_fields(spec))
+            # os erros de cada bloco seguem com ele (a leitura corre noutra thread)
+            erros = {"erros": []}
+            frame = _validate_keys(frame, spec["keys"], erros)
+            yield len(chunk), frame, erros["erros"]
+    finally:
+        workbook.close()
+
+
+def _read_ahead(frames):
+    # o bloco seguinte é lido numa thread enquanto o atual é escrito: leitura e
+    # escrita sobrepõem-se e só há um bloco à frente em memória
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="bundle-leitura") as leitor:
+        seguinte = leitor.submit(next, frames, None)
+        while True:
+            bloco = seguinte.result()
+            if bloco is None:
+                return
+            seguinte = leitor.submit(next, frames, None)
+            yield bloco
+
+
+def _with_file(erros, file_path):
+    nome = os.path.basename(file_path)
+    return [{**erro, "mensagem": f"{nome}: {erro['mensagem']}"} for erro in erros]
+
+
+# Pacote com as três folhas (produtos, fichas, preços): os cabeçalhos são
+# verificados antes de escrever e os dados aplicados por ordem, bloco a bloco,
+# numa única transação. Qualquer falha deixa a BD intacta.
+def process_bundle(file_paths, progress=None, import_id=None):
+    result = _new_result("bundle")
+    result["partes"] = {}
+    metrics = ImportMetrics(trace_memory=current_app.config.get("IMPORT_TRACE_MEMORY", False))
+    try:
+        _run_bundle(file_paths, result, metrics, progress, import_id)
+    finally:
+        metrics.close()
+
+    _store_errors(result, import_id)
+    return result
+
+
+def _duplicado(path, tipo):
+    return {"codigo": "E004", "mensagem": f"{os.path.basename(path)}: mais de um ficheiro de {tipo} no pacote"}
+
+
+def _run_bundle(file_paths, result, metrics, progress, import_id):
+    # ficheiros iguais à última importação do seu tipo nem chegam a ser lidos
+    with metrics.stage("leitura"):
+        digests = {path: _file_digest(path) for path in file_paths}
+        ultimos = {}
+        for tipo in ORDEM:
+            ultimo = ImportFicheiro.query.filter_by(Tipo=tipo).order_by(ImportFicheiro.Id.desc()).first()
+            if ultimo:
+                ultimos[ultimo.Digest] = tipo
+
+    inalterados, pendentes = {}, []
+    for path in file_paths:
+        tipo = ultimos.get(digests[path])
+        if tipo is None:
+            pendentes.append(path)
+        elif tipo in inalterados:
+            result["erros"].append(_duplicado(path, tipo))
+        else:
+            inalterados[tipo] = path
+
+    with metrics.stage("validacao"):
+        partes = [_detect_file(path) for path in pendentes]
+
+    por_tipo = {}
+    for parte in partes:
+        result["erros"].extend(_with_file(parte["erros"], parte["ficheiro"]))
+        tipo = parte["tipo"]
+        if tipo in por_tipo or tipo in inalterados:
+            result["erros"].append(_duplicado(parte["ficheiro"], tipo))
+        elif tipo:
+            por_tipo[tipo] = parte
+
+    # erros de ficheiro ou de cabeçalho invalidam o pacote inteiro
+    if any(erro["codigo"] in ("E001", "E002", "E003", "E004", "E010", "E011") for erro in result["erros"]):
+        result["status"] = "erro"
+        result["metricas"] = metrics.summary()
+        return
+
+    chunk_rows = current_app.config.get("IMPORT_CHUNK_ROWS", CHUNK_ROWS)
+    try:
+        processed = 0
+        for tipo in ORDEM:
+            if tipo in inalterados:
+                os.remove(inalterados[tipo])
+                result["partes"][tipo] = {"semAlteracoes": True}
+                continue
+            parte = por_tipo.get(tipo)
+            if parte is None:
+                continue
+
+            antes = {campo: result[campo] for campo in CONTADORES}
+            writer, state = IMPORTERS[tipo]["writer"], {}
+            blocos = _read_ahead(_iter_frames(parte, chunk_rows))
+            while True:
+                with metrics.stage("leitura"):
+                    bloco = next(blocos, None)
+                if bloco is None:
+                    break
+                linhas, frame, erros = bloco
+                metrics.add_rows("leitura", linhas)
+                result["linhasLidas"] += linhas
+                result["erros"].extend(_with_file(erros, parte["ficheiro"]))
+
+                with metrics.stage("escrita", len(frame)):
+                    writer(frame, result, state)
+                result["linhasImportadas"] += len(frame)
+                processed += linhas
+                if progress:
+                    progress("escrita", processed)
+                _store_errors(result, import_id)
+            if IMPORTERS[tipo]["finalizer"]:
+                with metrics.stage("escrita"):
+                    IMPORTERS[tipo]["finalizer"](result, state)
+            result["partes"][tipo] = {campo: result[campo] - antes[campo] for campo in CONTADORES}
+
+        for parte in por_tipo.values():
+            parte["arquivo"], parte["novo"] = _archive_name(parte["ficheiro"], digests[parte["ficheiro"]])
+
+        result["metricas"] = metrics.summary()
+        for tipo, parte in por_tipo.items():
+            db.session.add(ImportFicheiro(
+                Tipo=tipo,
+                Digest=digests[parte["ficheiro"]],
+                Ficheiro=parte["arquivo"],
+                Metricas=json.dumps(result["metricas"]),
+            ))
+        if _catalog_changed(result):
+            bump_catalog_version()
+        with metrics.stage("commit"):
+            db.session.commit()
+        with metrics.stage("arquivo"):
+            for parte in por_tipo.values():
+                _archive(parte["ficheiro"], parte["arquivo"], parte["novo"])
+        result["status"] = "sucesso"
+        result["semAlteracoes"] = not por_tipo
+        result["metricas"] = metrics.summary()
+
+    except Exception as exc:
+        db.session.rollback()
+        result["status"] = "erro"
+        result["erros"].append({"codigo": "E021", "mensagem": str(exc)})
+        result["metricas"] = metrics.summary()
@@ -0,0 +1,125 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import current_app
+
+from models import ImportErro, ImportJob, db
+from services.fichas_cache import warm_cache
+from services.import_bundle import process_bundle
+from services.import_service import process_import
+from services.storage import optimize_database
+
+
+_executor = None
+
+# a importação corre numa única transação, invisível até ao commit: o
+# progresso dos trabalhos em curso fica em memória, {job_id: (etapa, linhas)}
+_progresso = {}
+
+
+def _get_executor(app):
+    global _executor
+    if _executor is None:
+        # SQLite só admite um escritor: por omissão as importações correm em série
+        _executor = ThreadPoolExecutor(
+            max_workers=app.config.get("IMPORT_WORKERS", 1), thread_name_prefix="import"
+        )
+    return _executor
+
+
+def _run_job(app, job_id, file_path, tipo):
+    with app.app_context():
+        job = db.session.get(ImportJob, job_id)
+        job.Estado = "em_execucao"
+        job.Etapa = "leitura"
+        job.IniciadoEm = datetime.utcnow()
+        db.session.commit()
+
+        def progress(etapa, linhas):
+            _progresso[job_id] = (etapa, linhas)
+
+        try:
+            if tipo == "bundle":
+                result = process_bundle(file_path, progress=progress, import_id=job_id)
+            else:
+                result = process_import(file_path, tipo, progress=progress, import_id=job_id)
+        except Exception as exc:
+            db.session.rollback()
+            result = _falha(job_id, str(exc))
+
+        _, linhas = _progresso.pop(job_id, (None, job.LinhasProcessadas))
+        job = db.session.get(ImportJob, job_id)
+        job.Estado = "sucesso" if result.get("status") == "sucesso" else "erro"
+        job.Etapa = "concluido"
+        job.LinhasProcessadas = linhas
+        job.LinhasLidas = result.get("linhasLidas", 0)
+        job.LinhasImportadas = result.get("linhasImportadas", 0)
+        job.NumErros = result.get("numErros", 0)
+        job.ResumoErros = json.dumps(result.get("resumoErros", {}))
+        job.Resultado = json.dumps(result, default=str)
+        job.TerminadoEm = datetime.utcnow()
+        db.session.commit()
+
+        if job.Estado == "sucesso" and not result.get("semAlteracoes"):
+            try:
+                optimize_database()
+                # as fichas ficam em cache para a versão nova do catálogo
+                warm_cache()
+            except Exception as exc:
+                app.logger.warning("Falha a otimizar a base de dados ou a preparar a cache: %s", exc)
+
+
+def _falha(job_id, mensagem):
+    db.session.add(ImportErro(ImportId=job_id, Codigo="E021", Mensagem=mensagem))
+    return {
+        "status": "erro",
+        "numErros": 1,
+        "resumoErros": {"E021": 1},
+        "erros": [{"codigo": "E021", "mensagem": mensagem}],
+    }
+
+
+def submit_import(file_path, tipo, ficheiro=None):
+    app = current_app._get_current_object()
+
+    job = ImportJob(Tipo=tipo, Ficheiro=ficheiro or os.path.basename(file_path), Etapa="em_fila")
+    db.session.add(job)
+    db.session.commit()
+
+    _get_executor(app).submit(_run_job, app, job.Id, file_path, tipo)
+    return job
+
+
+def get_job(job_id):
+    return db.session.get(ImportJob, job_id)
+
+
+def serialize_job(job):
+    return job.serialize(progresso=_progresso.get(job.Id))
+
+
+def get_job_errors(job_id, after=None, limit=100):
+    # paginação por chave: a página seguinte começa depois do último Id devolvido
+    query = ImportErro.query.filter(ImportErro.ImportId == job_id)
+    if after is not None:
+        query = query.filter(ImportErro.Id > after)
+    erros = query.order_by(ImportErro.Id).limit(limit + 1).all()
+    next_page = erros[limit - 1].Id if len(erros) > limit else None
+    return erros[:limit], next_page
+
+
+def recover_interrupted_jobs():
+    # trabalhos que estavam na fila ou a correr quando o servidor parou
+    interrompidos = ImportJob.query.filter(ImportJob.Estado.in_(["pendente", "em_execucao"])).all()
+    for job in interrompidos:
+        job.Estado = "erro"
+        job.Etapa = "concluido"
+        result = _falha(job.Id, "Importação interrompida")
+        job.NumErros = result["numErros"]
+        job.ResumoErros = json.dumps(result["resumoErros"])
+        job.Resultado = json.dumps(result)
+        job.TerminadoEm = datetime.utcnow()
+    if interrompidos:
+        db.session.commit()
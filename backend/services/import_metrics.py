@@ -0,0 +1,90 @@
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+MB = 1024 * 1024
+
+# tracemalloc é global ao processo: só é parado quando a última importação
+# que o ligou terminar
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+
+
+def _start_tracing():
+    global _tracing_users
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _tracing_users += 1
+
+
+def _stop_tracing():
+    global _tracing_users
+    with _tracing_lock:
+        _tracing_users -= 1
+        if _tracing_users == 0 and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+def _peak_rss():
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss vem em KB no Linux e em bytes no macOS
+    return pico if sys.platform == "darwin" else pico * 1024
+
+
+# Sem tracemalloc (que torna a importação várias vezes mais lenta) o pico de
+# memória é o RSS máximo do processo até ao fim de cada etapa.
+class ImportMetrics:
+    def __init__(self, trace_memory=False):
+        self.etapas = {}
+        self.trace_memory = trace_memory
+        self._inicio = time.perf_counter()
+        self._pico = 0
+        self._tracing = trace_memory
+        if trace_memory:
+            _start_tracing()
+
+    @contextmanager
+    def stage(self, nome, linhas=0):
+        if self._tracing:
+            tracemalloc.reset_peak()
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            etapa = self.etapas.setdefault(nome, {"segundos": 0.0, "linhas": 0, "memoriaPicoMB": None})
+            etapa["segundos"] += time.perf_counter() - inicio
+            etapa["linhas"] += linhas
+            _, pico = tracemalloc.get_traced_memory() if self._tracing else (None, _peak_rss())
+            if pico is not None:
+                self._pico = max(self._pico, pico)
+                etapa["memoriaPicoMB"] = round(max(etapa["memoriaPicoMB"] or 0, pico / MB), 2)
+
+    def add_rows(self, nome, linhas):
+        self.etapas.setdefault(nome, {"segundos": 0.0, "linhas": 0, "memoriaPicoMB": None})["linhas"] += linhas
+
+    def summary(self):
+        return {
+            "totalSegundos": round(time.perf_counter() - self._inicio, 3),
+            "memoriaPicoMB": round(self._pico / MB, 2) if self._pico else None,
+            "memoriaFonte": "tracemalloc" if self.trace_memory else "rss",
+            "etapas": {
+                nome: {**etapa, "segundos": round(etapa["segundos"], 3)}
+                for nome, etapa in self.etapas.items()
+            },
+        }
+
+    def close(self):
+        if self._tracing:
+            self._tracing = False
+            _stop_tracing()
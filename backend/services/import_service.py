@@ -1,18 +1,40 @@
+import hashlib
+import json
 import os
 import re
 import unicodedata
 import shutil
 from datetime import datetime
 
+import numpy as np
 import pandas as pd
 from flask import current_app
+from openpyxl import load_workbook
+from sqlalchemy import insert
 
 from models import (
+    ImportErro,
+    ImportFicheiro,
     PrecoTaxa,
     Produto,
     FichaTecnica,
     db,
 )
+from services.bulk_upsert import ATUALIZADO, CRIADO, INALTERADO, BulkUpsert, sync_groups
+from services.alergenios_efetivos import recompute_alergenios_efetivos
+from services.custos_multinivel import recompute_custos_multinivel
+from services.ficha_totais import recompute_totais
+from services.fichas_cache import bump_catalog_version
+from services.fingerprints import group_hash, load_hashes, row_hashes, store_hashes
+from services.import_metrics import ImportMetrics
+from services.pesquisa import sync_pesquisa
+from services.utilizacoes import recompute_utilizacoes
+
+
+CHUNK_ROWS = 5000
+
+# erros devolvidos no resultado quando o detalhe fica gravado em ImportErros
+ERROS_AMOSTRA = 10
 
 
 COLUMN_ALIASES = {
@@ -143,44 +165,124 @@ def _normalize_header(header: str) -> str:
     return COLUMN_ALIASES.get(camel, camel)
 
 
-def _load_single_sheet(file_path):
+def _open_sheet(file_path):
     try:
-        xls = pd.ExcelFile(file_path)
+        workbook = load_workbook(file_path, read_only=True, data_only=True)
     except Exception as exc:
-        return None, [{"codigo": "E003", "mensagem": "Ficheiro não é Excel válido", "detalhe": str(exc)}]
+        return None, None, [{"codigo": "E003", "mensagem": "Ficheiro não é Excel válido", "detalhe": str(exc)}]
+
+    if len(workbook.sheetnames) == 0:
+        workbook.close()
+        return None, None, [{"codigo": "E001", "mensagem": "Ficheiro sem folhas"}]
+    if len(workbook.sheetnames) > 1:
+        workbook.close()
+        return None, None, [{"codigo": "E002", "mensagem": "Ficheiro com mais de uma folha"}]
+
+    return workbook, workbook[workbook.sheetnames[0]], []
+
+
+def _read_header(sheet):
+    rows = sheet.iter_rows(values_only=True)
+    header = next(rows, None) or ()
+    columns = [_normalize_header(col) if col is not None else "" for col in header]
+    return columns, rows
+
+
+def _iter_chunks(rows, columns, field_types, chunk_rows, group_by=None):
+    # só lê as colunas conhecidas do tipo de importação (a 1ª ocorrência de cada)
+    positions = {}
+    for position, column in enumerate(columns):
+        if column in field_types and column not in positions:
+            positions[column] = position
+    fields = list(positions)
+    wanted = list(positions.values())
+    group_pos = fields.index(group_by) if group_by in positions else None
+
+    buffer, index = [], []
+    for line, values in enumerate(rows, start=2):
+        if not any(value is not None for value in values):
+            continue
+        row = tuple(values[pos] if pos < len(values) else None for pos in wanted)
+        # um bloco cheio só fecha quando muda o grupo (ex.: produtoCodigo das fichas)
+        if len(buffer) >= chunk_rows and (group_pos is None or row[group_pos] != buffer[-1][group_pos]):
+            yield pd.DataFrame(buffer, columns=fields, index=index, dtype=object)
+            buffer, index = [], []
+        buffer.append(row)
+        index.append(line - 2)
+
+    if buffer:
+        yield pd.DataFrame(buffer, columns=fields, index=index, dtype=object)
+
+
+BOOL_VALUES = {
+    "1": True,
+    "true": True,
+    "sim": True,
+    "yes": True,
+    "y": True,
+    "x": True,
+    "0": False,
+    "false": False,
+    "nao": False,
+    "não": False,
+    "no": False,
+    "n": False,
+}
 
-    if len(xls.sheet_names) == 0:
-        return None, [{"codigo": "E001", "mensagem": "Ficheiro sem folhas"}]
-    if len(xls.sheet_names) > 1:
-        return None, [{"codigo": "E002", "mensagem": "Ficheiro com mais de uma folha"}]
 
-    df = pd.read_excel(xls, sheet_name=xls.sheet_names[0])
-    df.columns = [_normalize_header(col) for col in df.columns]
-    return df, []
+def _coerce_text(series):
+    text = series.astype("string")
+    # números inteiros lidos como float (coluna com vazios) não levam ".0"
+    if pd.api.types.is_float_dtype(series):
+        integral = series.notna() & (series % 1 == 0)
+        as_int = series.where(integral).astype("Int64").astype("string")
+        text = text.mask(integral, as_int)
+    elif series.dtype == object:
+        integral = series.map(type).eq(float) & (pd.to_numeric(series, errors="coerce") % 1 == 0)
+        text = text.mask(integral, text.str.slice(stop=-2))
+    # o openpyxl devolve as células de texto vazias como "": ficam NULL, como no read_excel
+    return text.mask(text.str.strip().eq("").fillna(False))
 
 
-def _parse_number(value, default=0.0):
-    if pd.isna(value):
-        return default
-    try:
-        return float(value)
-    except (TypeError, ValueError):
-        return default
+def _coerce_column(series, target_type):
+    if target_type == "bool":
+        numbers = pd.to_numeric(series, errors="coerce")
+        values = series.astype("string").str.strip().str.lower().map(BOOL_VALUES)
+        values = values.mask(numbers.eq(1), True).mask(numbers.eq(0), False)
+    elif target_type is float:
+        values = pd.to_numeric(series, errors="coerce")
+    elif target_type == int:
+        values = np.trunc(pd.to_numeric(series, errors="coerce")).astype("Int64")
+    else:
+        values = _coerce_text(series)
+    return values.astype(object).where(values.notna(), None)
 
 
-def _parse_bool(value):
-    if pd.isna(value):
-        return None
-    text = str(value).strip().lower()
-    if text in {"1", "true", "sim", "yes", "y", "x"}:
-        return True
-    if text in {"0", "false", "nao", "não", "no", "n"}:
-        return False
-    return None
+def _coerce_frame(df, field_types, keys):
+    fields = [f for f in field_types if f in df.columns]
+    frame = pd.DataFrame(
+        {field: _coerce_column(df[field], field_types[field]) for field in fields},
+        index=df.index,
+        dtype=object,
+    )
+    for key in keys:
+        if key not in frame.columns:
+            frame[key] = None
+            continue
+        stripped = frame[key].astype("string").str.strip()
+        frame[key] = stripped.astype(object).where(stripped.fillna("") != "", None)
+    return frame
 
 
-def _validate_headers(df, required_sets):
-    missing = [req for req in required_sets if not any(col in df.columns for col in req)]
+def _missing_key_errors(frame, mask, mensagem):
+    return [
+        {"codigo": "E020", "linha": int(idx) + 2, "mensagem": mensagem}
+        for idx in frame.index[mask]
+    ]
+
+
+def _validate_headers(columns, required_sets):
+    missing = [req for req in required_sets if not any(col in columns for col in req)]
     if missing:
         return [
             {
@@ -192,161 +294,375 @@ def _validate_headers(df, required_sets):
     return []
 
 
-def _assign_value(instance, field, value, field_types):
-    target_type = field_types.get(field)
-    if target_type == "bool":
-        parsed = _parse_bool(value)
-        if parsed is None:
-            return
-        setattr(instance, field, parsed)
-    elif target_type == int:
-        if pd.isna(value):
-            return
-        try:
-            setattr(instance, field, int(_parse_number(value, getattr(instance, field, 0) or 0)))
-        except (TypeError, ValueError):
-            return
-    elif target_type is float:
-        setattr(instance, field, _parse_number(value, getattr(instance, field, 0) or 0))
-    else:
-        if pd.isna(value):
-            return
-        setattr(instance, field, str(value))
-
-
-def _import_produtos(df, result):
-    errors = _validate_headers(df, [{"codigo"}, {"produto"}])
-    if errors:
-        return errors
-
-    for idx, row in df.iterrows():
-        codigo = str(row.get("codigo", "")).strip()
-        if not codigo:
-            result["erros"].append({"codigo": "E020", "linha": idx + 2, "mensagem": "Linha sem código principal"})
-            continue
-
-        produto = Produto.query.filter_by(codigo=codigo).first()
-        if not produto:
-            produto = Produto(codigo=codigo, produto=str(row.get("produto") or codigo))
-            db.session.add(produto)
+def _row_values(fields, row, field_types, current):
+    # None = célula vazia/inválida: mantém o valor atual (números vazios passam a 0)
+    values = {}
+    for field, value in zip(fields, row):
+        if value is not None:
+            values[field] = value
+        elif field_types.get(field) is float and (current or {}).get(field) is None:
+            values[field] = 0.0
+    return values
+
+
+def _count(result, estado):
+    key = {CRIADO: "criados", ATUALIZADO: "atualizados", INALTERADO: "inalterados"}[estado]
+    result[key] += 1
+
+
+def _changed_rows(frame, key, tipo, result):
+    # uma linha por chave, a última do ficheiro (é a que fica gravada): com
+    # várias (ex.: uma por loja nos preços) a reimportação não é idempotente
+    frame = frame.drop_duplicates(key, keep="last")
+    # só segue para escrita o que mudou desde a última importação
+    hashes = row_hashes(frame)
+    stored = frame[key].map(load_hashes(tipo, frame[key]))
+    changed = hashes.ne(stored)
+    result["inalterados"] += int((~changed).sum())
+    return frame[changed], hashes[changed]
+
+
+def _validate_keys(frame, key_rules, result):
+    # regras (campos, mensagem): sem mensagem a linha é ignorada sem erro
+    for campos, mensagem in key_rules:
+        invalidas = frame[list(campos)].isna().any(axis=1)
+        if mensagem:
+            result["erros"].extend(_missing_key_errors(frame, invalidas, mensagem))
+        frame = frame[~invalidas]
+    return frame
+
+
+def _import_produtos(frame, result, state):
+    frame, hashes = _changed_rows(frame, "codigo", "produtos", result)
+
+    campos = list(frame.columns)
+    produtos = BulkUpsert(Produto, "codigo")
+    produtos.prefetch(frame["codigo"])
+
+    for linha in frame.itertuples(index=False, name=None):
+        registo = dict(zip(campos, linha))
+        codigo = registo["codigo"]
+        atual = produtos.get(codigo)
+        valores = {} if atual else {"produto": codigo}
+        valores.update(_row_values(campos, linha, PRODUTO_FIELD_TYPES, atual))
+        estado = produtos.upsert(codigo, valores)
+        _count(result, estado)
+        if estado == CRIADO:
             result["produtos"] += 1
 
-        for field in PRODUTO_FIELD_TYPES:
-            if field not in df.columns:
-                continue
-            _assign_value(produto, field, row.get(field), PRODUTO_FIELD_TYPES)
-
-    return []
+    produtos.flush()
+    store_hashes("produtos", dict(zip(frame["codigo"], hashes)))
+    state.setdefault("pesquisa", set()).update(frame["codigo"])
+
+
+def _import_fichas(frame, result, state):
+    primeiras = frame.drop_duplicates("produtoCodigo")
+    nomes = primeiras["produtoNome"] if "produtoNome" in frame.columns else primeiras["produtoCodigo"]
+    produtos = BulkUpsert(Produto, "codigo")
+    produtos.prefetch(primeiras["produtoCodigo"])
+    for codigo_ficha, nome in zip(primeiras["produtoCodigo"], nomes):
+        if produtos.get(codigo_ficha) is None:
+            produtos.upsert(codigo_ficha, {"produto": nome or codigo_ficha})
+            state.setdefault("pesquisa", set()).add(codigo_ficha)
+    produtos.flush()
+
+    campos = [f for f in frame.columns if f != "produtoCodigo"]
+    vazios = {f: None for f in FICHA_FIELD_TYPES if f not in ("produtoCodigo", "componenteCodigo")}
+    hashes = row_hashes(frame)
+    stored = load_hashes("fichas", primeiras["produtoCodigo"])
+    vistas = state.setdefault("fichas_vistas", {})
+    novos_hashes = {}
+    alteradas, acrescentadas = {}, {}
+
+    # um produto repetido mais abaixo no ficheiro acrescenta linhas às que já
+    # foram importadas nesta execução em vez de as substituir
+    for codigo_ficha, group in frame.groupby("produtoCodigo", sort=False):
+        hash_grupo = group_hash(hashes[group.index])
+
+        if codigo_ficha in vistas:
+            hash_grupo = group_hash([vistas[codigo_ficha], hash_grupo])
+            destino = acrescentadas
+        elif stored.get(codigo_ficha) == hash_grupo:
+            vistas[codigo_ficha] = hash_grupo
+            result["inalterados"] += 1
+            continue
+        else:
+            destino = alteradas
 
+        vistas[codigo_ficha] = hash_grupo
+        novos_hashes[codigo_ficha] = hash_grupo
 
-def _import_fichas(df, result):
-    errors = _validate_headers(df, [{"produtoCodigo"}, {"componenteCodigo"}])
-    if errors:
-        return errors
+        linhas = destino.setdefault(codigo_ficha, {})
+        for linha in group[campos].itertuples(index=False, name=None):
+            valores = {**vazios, **_row_values(campos, linha, FICHA_FIELD_TYPES, None)}
+            linhas[valores.pop("componenteCodigo")] = valores
 
-    # agrupa por produto para recriar registos
-    for codigo_ficha, group in df.groupby("produtoCodigo"):
-        codigo_ficha = str(codigo_ficha or "").strip()
-        if not codigo_ficha:
+    # só as diferenças face às linhas existentes (uq_ficha_codigo_componente)
+    for grupos, substituir in ((alteradas, True), (acrescentadas, False)):
+        if not grupos:
             continue
+        diff = sync_groups(FichaTecnica, "codigo", "componenteCodigo", grupos, delete_missing=substituir)
+        result["fichas"] += diff["inseridas"] + diff["atualizadas"]
+        recompute_totais(diff["alterados"])
+        state.setdefault("fichas_alteradas", set()).update(diff["alterados"])
+        state.setdefault("pesquisa", set()).update(diff["alterados"])
+        if substituir:
+            result["criados"] += len(grupos.keys() - diff["existentes"])
+            result["atualizados"] += len(diff["existentes"] & diff["alterados"])
+            result["inalterados"] += len(diff["existentes"] - diff["alterados"])
+        else:
+            result["atualizados"] += len(grupos)
 
-        Produto.query.filter_by(codigo=codigo_ficha).first() or db.session.add(
-            Produto(codigo=codigo_ficha, produto=str(group.iloc[0].get("produtoNome") or codigo_ficha))
-        )
+    store_hashes("fichas", novos_hashes)
 
-        FichaTecnica.query.filter_by(codigo=codigo_ficha).delete()
-        result["fichas"] += 0
 
-        for _, row in group.iterrows():
-            componente_codigo = str(row.get("componenteCodigo", "")).strip()
-            if not componente_codigo:
-                result["erros"].append({"codigo": "E020", "mensagem": "Linha sem componente", "linha": int(_ + 2)})
-                continue
+def _finalize_pesquisa(result, state):
+    sync_pesquisa(state.get("pesquisa"))
 
-            ficha = FichaTecnica(codigo=codigo_ficha, componenteCodigo=componente_codigo)
-            db.session.add(ficha)
 
-            for field in FICHA_FIELD_TYPES:
-                if field not in df.columns:
-                    continue
-                if field == "produtoCodigo":
-                    continue
-                _assign_value(ficha, field, row.get(field), FICHA_FIELD_TYPES)
+def _finalize_fichas(result, state):
+    # o custo multinível, os alergénios e as utilizações de uma ficha dependem
+    # de todas as sub-fichas: só no fim
+    if state.get("fichas_alteradas"):
+        recompute_custos_multinivel()
+        recompute_alergenios_efetivos(state["fichas_alteradas"])
+        recompute_utilizacoes(state["fichas_alteradas"])
+    _finalize_pesquisa(result, state)
 
-            result["fichas"] += 1
 
-    return []
+def _import_precos(frame, result, state):
+    result["precos"] += len(frame)
+    frame, hashes = _changed_rows(frame, "prodVenda", "precos", result)
 
+    campos = list(frame.columns)
+    produtos = BulkUpsert(Produto, "codigo")
+    precos = BulkUpsert(PrecoTaxa, "produtoCodigo")
+    produtos.prefetch(frame["prodVenda"])
+    precos.prefetch(frame["prodVenda"])
 
-def _import_precos(df, result):
-    errors = _validate_headers(df, [{"prodVenda"}, {"loja"}])
-    if errors:
-        return errors
+    for linha in frame.itertuples(index=False, name=None):
+        registo = dict(zip(campos, linha))
+        codigo = registo["prodVenda"]
+        if produtos.get(codigo) is None:
+            produtos.upsert(codigo, {"produto": registo.get("nomeProdVenda") or codigo})
+            result["produtos"] += 1
+            state.setdefault("pesquisa", set()).add(codigo)
+
+        atual = precos.get(codigo)
+        _count(result, precos.upsert(codigo, _row_values(campos, linha, PRECO_FIELD_TYPES, atual)))
+
+    # os produtos têm de existir antes dos preços (FK produtoCodigo)
+    produtos.flush()
+    precos.flush()
+    store_hashes("precos", dict(zip(frame["prodVenda"], hashes)))
+
+
+def _file_digest(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as handle:
+        for block in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _archive_name(file_path, digest):
+    # cada ficheiro distinto é guardado uma única vez no histórico:
+    # (nome no histórico, se o ficheiro ainda tem de ser movido para lá)
+    history_path = os.path.join(current_app.config["UPLOAD_FOLDER"], "history")
+    anterior = ImportFicheiro.query.filter_by(Digest=digest).first()
+    if anterior and os.path.exists(os.path.join(history_path, anterior.Ficheiro)):
+        return anterior.Ficheiro, False
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"{timestamp}_{os.path.basename(file_path)}", True
+
+
+# Só depois do commit: se falhar, o ficheiro fica no upload, sem cópia no
+# histórico que o ImportFicheiro revertido não regista
+def _archive(file_path, arquivo, novo):
+    if not novo:
+        os.remove(file_path)
+        return
+    history_path = os.path.join(current_app.config["UPLOAD_FOLDER"], "history")
+    os.makedirs(history_path, exist_ok=True)
+    shutil.move(file_path, os.path.join(history_path, arquivo))
+
+
+IMPORTERS = {
+    "produtos": {
+        "field_types": PRODUTO_FIELD_TYPES,
+        "required": [{"codigo"}, {"produto"}],
+        "keys": [(("codigo",), "Linha sem código principal")],
+        # as linhas repetidas de um código ficam no mesmo bloco
+        "group_by": "codigo",
+        "writer": _import_produtos,
+        "finalizer": _finalize_pesquisa,
+    },
+    "fichas": {
+        "field_types": FICHA_FIELD_TYPES,
+        "required": [{"produtoCodigo"}, {"componenteCodigo"}],
+        "keys": [(("produtoCodigo",), None), (("componenteCodigo",), "Linha sem componente")],
+        "group_by": "produtoCodigo",
+        "writer": _import_fichas,
+        "finalizer": _finalize_fichas,
+    },
+    "precos": {
+        "field_types": PRECO_FIELD_TYPES,
+        "required": [{"prodVenda"}, {"loja"}],
+        "keys": [(("prodVenda", "loja"), "Linha sem código principal")],
+        "group_by": "prodVenda",
+        "writer": _import_precos,
+        "finalizer": _finalize_pesquisa,
+    },
+}
 
-    for idx, row in df.iterrows():
-        codigo = str(row.get("prodVenda", "")).strip()
-        loja = str(row.get("loja", "")).strip()
 
-        if not codigo or not loja:
-            result["erros"].append({"codigo": "E020", "linha": idx + 2, "mensagem": "Linha sem código principal"})
-            continue
+def _new_result(tipo):
+    return {
+        "tipo": tipo,
+        "fichas": 0,
+        "ingredientes": 0,
+        "produtos": 0,
+        "precos": 0,
+        "criados": 0,
+        "atualizados": 0,
+        "inalterados": 0,
+        "linhasLidas": 0,
+        "linhasImportadas": 0,
+        "numErros": 0,
+        "resumoErros": {},
+        "erros": [],
+    }
 
-        produto = Produto.query.filter_by(codigo=codigo).first()
-        if not produto:
-            produto = Produto(codigo=codigo, produto=str(row.get("nomeProdVenda") or codigo))
-            db.session.add(produto)
-            db.session.flush()
-            result["produtos"] += 1
 
-        preco = PrecoTaxa.query.filter_by(produtoCodigo=codigo).first()
-        if not preco:
-            preco = PrecoTaxa(produtoCodigo=codigo, loja=loja)
-            db.session.add(preco)
+def _catalog_changed(result):
+    return bool(result["criados"] or result["atualizados"] or result["produtos"])
 
-        for field in PRECO_FIELD_TYPES:
-            if field not in df.columns:
-                continue
-            _assign_value(preco, field, row.get(field), PRECO_FIELD_TYPES)
 
-        result["precos"] += 1
-
-    return []
+def _key_fields(spec):
+    return [campo for campos, _ in spec["keys"] for campo in campos]
 
 
-def process_import(file_path, tipo):
-    result = {"tipo": tipo, "fichas": 0, "ingredientes": 0, "produtos": 0, "precos": 0, "erros": []}
+def process_import(file_path, tipo, progress=None, import_id=None):
+    result = _new_result(tipo)
 
     tipo = (tipo or "").strip().lower()
-    if tipo not in {"produtos", "fichas", "precos"}:
-        return {"status": "erro", "erros": [{"codigo": "E011", "mensagem": "Tipo de importação desconhecido"}]}
+    if tipo not in IMPORTERS:
+        result.update({"status": "erro", "erros": [{"codigo": "E011", "mensagem": "Tipo de importação desconhecido"}]})
+    else:
+        metrics = ImportMetrics(trace_memory=current_app.config.get("IMPORT_TRACE_MEMORY", False))
+        try:
+            result = _run_import(file_path, tipo, IMPORTERS[tipo], result, metrics, progress, import_id)
+        finally:
+            metrics.close()
+
+    _store_errors(result, import_id)
+    return result
 
-    df, file_errors = _load_single_sheet(file_path)
+
+# Passa os erros novos do resultado para o resumo por código e, com import_id,
+# grava-os em ImportErros deixando no resultado só os primeiros ERROS_AMOSTRA.
+# ImportErros está na BD dos trabalhos e é escrito numa transação própria,
+# confirmada logo: não fica preso à transação da importação.
+def _store_errors(result, import_id):
+    gravados = min(result["numErros"], ERROS_AMOSTRA) if import_id else result["numErros"]
+    novos = result["erros"][gravados:]
+    if not novos:
+        return
+    resumo = result["resumoErros"]
+    for erro in novos:
+        resumo[erro["codigo"]] = resumo.get(erro["codigo"], 0) + 1
+    result["numErros"] += len(novos)
+
+    if not import_id:
+        return
+    rows = [
+        {"ImportId": import_id, "Linha": erro.get("linha"), "Codigo": erro["codigo"], "Mensagem": erro.get("mensagem")}
+        for erro in novos
+    ]
+    with db.engines[ImportErro.__bind_key__].begin() as connection:
+        connection.execute(insert(ImportErro.__table__), rows)
+    del result["erros"][ERROS_AMOSTRA:]
+
+
+def _run_import(file_path, tipo, spec, result, metrics, progress, import_id):
+    # reenvio do mesmo ficheiro que a última importação deste tipo: nada a fazer
+    with metrics.stage("leitura"):
+        digest = _file_digest(file_path)
+        ultimo = ImportFicheiro.query.filter_by(Tipo=tipo).order_by(ImportFicheiro.Id.desc()).first()
+    if ultimo and ultimo.Digest == digest:
+        os.remove(file_path)
+        result.update({"status": "sucesso", "semAlteracoes": True, "metricas": metrics.summary()})
+        return result
+
+    with metrics.stage("leitura"):
+        workbook, sheet, file_errors = _open_sheet(file_path)
     if file_errors:
-        return {"status": "erro", "erros": file_errors}
+        result.update({"status": "erro", "erros": file_errors})
+        return result
 
     try:
-        if tipo == "produtos":
-            header_errors = _import_produtos(df, result)
-        elif tipo == "fichas":
-            header_errors = _import_fichas(df, result)
-        else:
-            header_errors = _import_precos(df, result)
-
+        with metrics.stage("normalizacao"):
+            columns, rows = _read_header(sheet)
+        with metrics.stage("validacao"):
+            header_errors = _validate_headers(columns, spec["required"])
         if header_errors:
-            db.session.rollback()
-            return {"status": "erro", "erros": header_errors}
+            result.update({"status": "erro", "erros": header_errors})
+            return result
+
+        # os blocos são escritos à medida que são lidos, mas tudo numa só
+        # transação: as leituras veem o catálogo anterior até ao commit final
+        chunk_rows = current_app.config.get("IMPORT_CHUNK_ROWS", CHUNK_ROWS)
+        chunks = _iter_chunks(rows, columns, spec["field_types"], chunk_rows, spec["group_by"])
+        state = {}
+        processed = 0
+        while True:
+            with metrics.stage("leitura"):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            metrics.add_rows("leitura", len(chunk))
+            result["linhasLidas"] += len(chunk)
+
+            with metrics.stage("normalizacao", len(chunk)):
+                frame = _coerce_frame(chunk, spec["field_types"], _key_fields(spec))
+            with metrics.stage("validacao", len(frame)):
+                frame = _validate_keys(frame, spec["keys"], result)
+            with metrics.stage("escrita", len(frame)):
+                spec["writer"](frame, result, state)
+            result["linhasImportadas"] += len(frame)
+
+            processed += len(chunk)
+            if progress:
+                progress("escrita", processed)
+            _store_errors(result, import_id)
+
+        if spec["finalizer"]:
+            with metrics.stage("escrita"):
+                spec["finalizer"](result, state)
 
-        db.session.commit()
         result["status"] = "sucesso"
+        workbook.close()
 
-        history_path = os.path.join(current_app.config["UPLOAD_FOLDER"], "history")
-        os.makedirs(history_path, exist_ok=True)
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        shutil.move(file_path, os.path.join(history_path, f"{timestamp}_{os.path.basename(file_path)}"))
+        arquivo, novo = _archive_name(file_path, digest)
+        result["metricas"] = metrics.summary()
+        db.session.add(
+            ImportFicheiro(Tipo=tipo, Digest=digest, Ficheiro=arquivo, Metricas=json.dumps(result["metricas"]))
+        )
+        if _catalog_changed(result):
+            bump_catalog_version()
+        with metrics.stage("commit"):
+            db.session.commit()
+        with metrics.stage("arquivo"):
+            _archive(file_path, arquivo, novo)
+        result["metricas"] = metrics.summary()
 
     except Exception as exc:
         db.session.rollback()
         result["status"] = "erro"
         result["erros"].append({"codigo": "E021", "mensagem": str(exc)})
+        result["metricas"] = metrics.summary()
+
+    finally:
+        workbook.close()
 
     return result
@@ -0,0 +1,192 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+from sqlalchemy import select
+
+from models import Produto, db
+from services.import_service import (
+    CHUNK_ROWS,
+    IMPORTERS,
+    _coerce_frame,
+    _iter_chunks,
+    _key_fields,
+    _open_sheet,
+    _read_header,
+    _validate_headers,
+    _validate_keys,
+)
+
+
+# folhas com mais linhas do que isto são validadas em paralelo
+PARALLEL_MIN_ROWS = 50000
+
+# colunas com códigos de produto: (coluna, a importação cria produto provisório)
+REFERENCIAS = {
+    "produtos": [],
+    "fichas": [("produtoCodigo", True), ("componenteCodigo", False)],
+    "precos": [("prodVenda", True)],
+}
+
+
+def _type_warnings(chunk, frame, field_types):
+    # valores preenchidos que a conversão deixou vazios (a importação grava-os a
+    # NULL sem falhar: são avisos)
+    avisos = []
+    for field, target in field_types.items():
+        if target is str or field not in chunk.columns:
+            continue
+        original = chunk[field].astype("string").str.strip().fillna("")
+        invalidos = (original != "") & frame[field].isna()
+        for idx in chunk.index[invalidos]:
+            avisos.append({
+                "codigo": "E021",
+                "linha": int(idx) + 2,
+                "mensagem": f"Tipo de dado inválido em {field}: {chunk.at[idx, field]}",
+            })
+    return avisos
+
+
+# Corre num processo do pool: só pandas, sem acesso à BD
+def _validate_chunk(tipo, chunk):
+    spec = IMPORTERS[tipo]
+    result = {"erros": []}
+    frame = _coerce_frame(chunk, spec["field_types"], _key_fields(spec))
+    avisos = _type_warnings(chunk, frame, spec["field_types"])
+    frame = _validate_keys(frame, spec["keys"], result)
+
+    referencias = {}
+    for coluna, _ in REFERENCIAS[tipo]:
+        primeiras = frame.drop_duplicates(coluna)
+        referencias[coluna] = dict(zip(primeiras[coluna], primeiras.index + 2))
+    return {
+        "erros": result["erros"],
+        "avisos": avisos,
+        "linhas": len(chunk),
+        "validas": len(frame),
+        "referencias": referencias,
+    }
+
+
+_pool = None
+_pool_workers = 0
+
+
+# Pool de processos da validação, criado no arranque antes de haver outras
+# threads: um fork a partir do servidor já com threads pode herdar locks presos.
+# fork e não spawn: com spawn cada processo voltaria a importar app.py
+# (create_all, seed, ...). Opcional: sem IMPORT_VALIDATION_WORKERS, sem fork
+# ou com um só processo, valida em série e não cria processos.
+def init_validation_pool(app):
+    global _pool, _pool_workers
+    workers = min(app.config.get("IMPORT_VALIDATION_WORKERS") or 0, os.cpu_count() or 1)
+    if _pool is not None or workers < 2 or "fork" not in multiprocessing.get_all_start_methods():
+        return
+    _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"))
+    _pool_workers = workers
+    # com fork todos os processos são criados logo no primeiro submit
+    _pool.submit(os.getpid).result()
+
+
+def _iter_results(tipo, chunks, parallel):
+    if not parallel or _pool is None:
+        for chunk in chunks:
+            yield _validate_chunk(tipo, chunk)
+        return
+
+    # no máximo dois blocos por processo em memória de cada vez
+    pendentes = []
+    for chunk in chunks:
+        pendentes.append(_pool.submit(_validate_chunk, tipo, chunk))
+        if len(pendentes) >= _pool_workers * 2:
+            yield pendentes.pop(0).result()
+    for futuro in pendentes:
+        yield futuro.result()
+
+
+def _missing_products(codigos, batch_size=500):
+    codigos = list(codigos)
+    existentes = set()
+    for start in range(0, len(codigos), batch_size):
+        chunk = codigos[start:start + batch_size]
+        existentes.update(db.session.scalars(select(Produto.codigo).where(Produto.codigo.in_(chunk))))
+    return [c for c in codigos if c not in existentes]
+
+
+# Validação sem escrita: as mesmas verificações de process_import (ficheiro,
+# cabeçalhos, conversão de tipos, chaves) mais as referências a produtos.
+# Os erros e o status são os que a importação daria; conversões falhadas e
+# produtos em falta, que a importação aceita, vêm em avisos.
+def validate_import(file_path, tipo):
+    result = {
+        "tipo": tipo,
+        "dryRun": True,
+        "linhasLidas": 0,
+        "linhasValidas": 0,
+        "erros": [],
+        "avisos": [],
+    }
+
+    tipo = (tipo or "").strip().lower()
+    if tipo not in IMPORTERS:
+        result.update({"status": "erro", "erros": [{"codigo": "E011", "mensagem": "Tipo de importação desconhecido"}]})
+        return result
+
+    spec = IMPORTERS[tipo]
+    workbook, sheet, file_errors = _open_sheet(file_path)
+    if file_errors:
+        result.update({"status": "erro", "erros": file_errors})
+        return result
+
+    try:
+        columns, rows = _read_header(sheet)
+        header_errors = _validate_headers(columns, spec["required"])
+        if header_errors:
+            result.update({"status": "erro", "erros": header_errors})
+            return result
+
+        chunk_rows = current_app.config.get("IMPORT_CHUNK_ROWS", CHUNK_ROWS)
+        min_rows = current_app.config.get("IMPORT_VALIDATION_PARALLEL_ROWS", PARALLEL_MIN_ROWS)
+        parallel = (sheet.max_row or 0) > min_rows
+        chunks = _iter_chunks(rows, columns, spec["field_types"], chunk_rows, spec["group_by"])
+
+        referencias = {coluna: {} for coluna, _ in REFERENCIAS[tipo]}
+        for parcial in _iter_results(tipo, chunks, parallel):
+            result["linhasLidas"] += parcial["linhas"]
+            result["linhasValidas"] += parcial["validas"]
+            result["erros"].extend(parcial["erros"])
+            result["avisos"].extend(parcial["avisos"])
+            for coluna, codigos in parcial["referencias"].items():
+                for codigo, linha in codigos.items():
+                    referencias[coluna].setdefault(codigo, linha)
+    finally:
+        workbook.close()
+
+    # os produtos provisórios criados pela importação deixam de faltar às outras colunas
+    provisorios = set()
+    for coluna, provisorio in REFERENCIAS[tipo]:
+        if provisorio:
+            provisorios.update(referencias[coluna])
+
+    for coluna, provisorio in REFERENCIAS[tipo]:
+        sufixo = " (será criado produto provisório)" if provisorio else ""
+        codigos = referencias[coluna] if provisorio else [c for c in referencias[coluna] if c not in provisorios]
+        for codigo in _missing_products(codigos):
+            result["avisos"].append({
+                "codigo": "E022",
+                "linha": int(referencias[coluna][codigo]),
+                "mensagem": f"Produto referenciado não existe: {codigo}{sufixo}",
+            })
+
+    for chave in ("erros", "avisos"):
+        result[chave].sort(key=lambda erro: erro.get("linha") or 0)
+    result["numErros"] = len(result["erros"])
+    result["numAvisos"] = len(result["avisos"])
+    for chave, resumo in (("erros", "resumoErros"), ("avisos", "resumoAvisos")):
+        result[resumo] = {}
+        for erro in result[chave]:
+            result[resumo][erro["codigo"]] = result[resumo].get(erro["codigo"], 0) + 1
+    # linhas sem chave (E020) são ignoradas, como na importação: não a fazem falhar
+    result["status"] = "sucesso"
+    return result
@@ -0,0 +1,105 @@
+import re
+
+from sqlalchemy import bindparam, text
+
+from models import db
+from services.bulk_upsert import BATCH_SIZE
+
+
+# Índice FTS5 (só SQLite) sobre os produtos e os nomes dos componentes das suas
+# fichas; unicode61 com remove_diacritics: "bras" encontra "Brás". O rowid é
+# produtos.id.
+TABELA = "ProdutosPesquisa"
+
+# pesos do bm25 pela ordem das colunas: códigos e nome pesam mais que componentes
+PESOS = (10.0, 5.0, 3.0, 10.0, 1.0)
+
+_CRIAR = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {TABELA} USING fts5(
+    codigo, produto, nomeProdVenda, codBarras, componentes,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+)
+"""
+
+_INSERIR = f"""
+INSERT INTO {TABELA} (rowid, codigo, produto, nomeProdVenda, codBarras, componentes)
+SELECT p.id, p.codigo, p.produto, p.nomeProdVenda, p.codBarras,
+       (SELECT group_concat(f.componenteNome, ' ') FROM fichas_tecnicas f WHERE f.codigo = p.codigo)
+FROM produtos p
+"""
+
+
+def pesquisa_disponivel():
+    return db.engine.dialect.name == "sqlite"
+
+
+def init_pesquisa():
+    if not pesquisa_disponivel():
+        return
+    with db.engine.begin() as connection:
+        connection.execute(text(_CRIAR))
+        vazia = connection.execute(text(f"SELECT rowid FROM {TABELA} LIMIT 1")).first() is None
+        if vazia:
+            # bases de dados com produtos anteriores ao índice
+            connection.execute(text(_INSERIR))
+
+
+# Atualiza as entradas dos produtos indicados, na transação corrente
+def sync_pesquisa(codigos, batch_size=BATCH_SIZE):
+    if not pesquisa_disponivel() or not codigos:
+        return
+    codigos = list(codigos)
+    apagar = text(
+        f"DELETE FROM {TABELA} WHERE rowid IN (SELECT id FROM produtos WHERE codigo IN :codigos)"
+    ).bindparams(bindparam("codigos", expanding=True))
+    inserir = text(f"{_INSERIR} WHERE p.codigo IN :codigos").bindparams(bindparam("codigos", expanding=True))
+    for start in range(0, len(codigos), batch_size):
+        chunk = codigos[start:start + batch_size]
+        db.session.execute(apagar, {"codigos": chunk})
+        db.session.execute(inserir, {"codigos": chunk})
+
+
+def _expressao(termos):
+    # cada palavra como prefixo ("bacal" encontra "bacalhau"); aspas evitam a
+    # sintaxe do FTS5 (AND, NEAR, -, ...) no texto do utilizador
+    palavras = re.findall(r"\w+", termos or "")
+    return " ".join(f'"{palavra}"*' for palavra in palavras)
+
+
+def pesquisar(termos, limit, offset, so_fichas=False):
+    expressao = _expressao(termos)
+    if not expressao:
+        return 0, []
+
+    filtro = f"{TABELA} MATCH :expressao"
+    if so_fichas:
+        filtro += ' AND EXISTS (SELECT 1 FROM "FichaTotais" t WHERE t."ProdutoCodigo" = p.codigo)'
+
+    total = db.session.execute(
+        text(f"SELECT count(*) FROM {TABELA} JOIN produtos p ON p.id = {TABELA}.rowid WHERE {filtro}"),
+        {"expressao": expressao},
+    ).scalar()
+    linhas = db.session.execute(
+        text(
+            f"""
+            SELECT p.codigo, p.produto, p.nomeProdVenda, p.codBarras,
+                   EXISTS (SELECT 1 FROM "FichaTotais" t WHERE t."ProdutoCodigo" = p.codigo) AS tem_ficha
+            FROM {TABELA} JOIN produtos p ON p.id = {TABELA}.rowid
+            WHERE {filtro}
+            ORDER BY bm25({TABELA}, {", ".join(str(peso) for peso in PESOS)}), p.codigo
+            LIMIT :limit OFFSET :offset
+            """
+        ),
+        {"expressao": expressao, "limit": limit, "offset": offset},
+    ).all()
+    return total, [
+        {
+            "codigo": codigo,
+            "nome": produto or nome_venda or codigo,
+            "nome_prod_venda": nome_venda,
+            "cod_barras": cod_barras,
+            "tem_ficha": bool(tem_ficha),
+        }
+        for codigo, produto, nome_venda, cod_barras, tem_ficha in linhas
+    ]
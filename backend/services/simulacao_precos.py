@@ -0,0 +1,146 @@
+import numpy as np
+import pandas as pd
+from sqlalchemy import Float, String, and_, case, column, false, func, select, type_coerce, values
+
+from models import FichaCustoMultinivel, FichaTecnica, FichaTotais, PrecoTaxa, Produto, db
+from services.bulk_upsert import em_lotes
+
+
+# códigos por consulta (dois parâmetros cada)
+BATCH_SIZE = 5000
+
+COLUNAS = ["codigo", "nome", "custo_atual", "custo_novo", "delta", "delta_pct", "food_cost_atual", "food_cost_novo"]
+
+
+# A variação direta de cada ficha (linhas dos componentes alterados, somada na
+# BD) e, nível a nível a partir das fichas afetadas, as linhas das sub-fichas
+# expandidas no custo multinível, por onde a variação sobe às fichas que as
+# usam. Cada linha é lida uma só vez, pelo índice de componenteCodigo.
+def _variacoes_por_nivel(variacoes):
+    fichas = FichaTecnica.__table__
+    multinivel = FichaCustoMultinivel.__table__
+    preco, qtd, ppu = (type_coerce(fichas.c[c], Float) for c in ("preco", "qtd", "ppu"))
+
+    # a regra de calcular_preco_linha, com os valores arredondados como Numeric(12, 4)
+    custo_linha = case(
+        (preco.is_not(None), func.round(preco, 4)),
+        else_=func.round(func.coalesce(qtd, 0), 4) * func.round(func.coalesce(ppu, 0), 4),
+    )
+    # como em custos_multinivel._avaliar: expande-se a sub-ficha resolvida (fora
+    # de ciclos) com custo; nas restantes fica o custo da linha
+    sub_ficha = and_(
+        multinivel.c.ProdutoCodigo == fichas.c.componenteCodigo,
+        multinivel.c.CustoTotal != 0,
+        multinivel.c.Ciclo == false(),
+    )
+    expandida = multinivel.c.ProdutoCodigo.is_not(None)
+
+    diretas = {}
+    codigos = list(variacoes)
+    for start in range(0, len(codigos), BATCH_SIZE):
+        tabela = values(column("componente", String), column("fracao", Float), name="variacoes").data(
+            [(codigo, variacoes[codigo]) for codigo in codigos[start:start + BATCH_SIZE]]
+        ).cte()
+        query = (
+            select(fichas.c.codigo, func.sum(custo_linha * tabela.c.fracao))
+            .join(tabela, tabela.c.componente == fichas.c.componenteCodigo)
+            .outerjoin(multinivel, sub_ficha)
+            .where(~expandida)
+            .group_by(fichas.c.codigo)
+        )
+        for codigo, delta in db.session.execute(query):
+            diretas[codigo] = diretas.get(codigo, 0.0) + delta
+
+    arestas = {}
+    vistos = set(variacoes) | set(diretas)
+    fronteira = set(vistos)
+    while fronteira:
+        seguinte = set()
+        for chunk in em_lotes(fronteira, BATCH_SIZE):
+            query = (
+                select(fichas.c.codigo, fichas.c.componenteCodigo, func.round(func.coalesce(qtd, 0), 4))
+                .join(multinivel, sub_ficha)
+                .where(fichas.c.componenteCodigo.in_(chunk))
+            )
+            for codigo, componente, qtd_linha in db.session.execute(query):
+                arestas.setdefault(codigo, []).append((componente, qtd_linha))
+                seguinte.add(codigo)
+        fronteira = seguinte - vistos
+        vistos |= fronteira
+    return diretas, arestas
+
+
+# {codigo: variação do custo multinível}: a variação direta mais, por cada
+# sub-ficha expandida e afetada, qtd × a variação dela. Só há expansão para
+# sub-fichas fora de ciclos, logo a recursão termina.
+def _propagar(diretas, arestas):
+    deltas = {}
+
+    def _delta(codigo):
+        if codigo not in deltas:
+            total = diretas.get(codigo)
+            for componente, qtd in arestas.get(codigo, ()):
+                sub = _delta(componente)
+                if sub is not None:
+                    total = (total or 0.0) + qtd * sub
+            deltas[codigo] = total
+        return deltas[codigo]
+
+    for codigo in set(diretas) | set(arestas):
+        _delta(codigo)
+    return {codigo: delta for codigo, delta in deltas.items() if delta is not None}
+
+
+def _deltas(variacoes):
+    # variação do custo de cada ficha afetada, direta ou através de sub-fichas
+    totais = FichaTotais.__table__
+    multinivel = FichaCustoMultinivel.__table__
+    precos = PrecoTaxa.__table__
+    produtos = Produto.__table__
+
+    deltas = _propagar(*_variacoes_por_nivel(variacoes))
+
+    # o custo atual é o multinível, o mesmo a que a variação se aplica
+    custo_atual = func.coalesce(multinivel.c.CustoTotal, totais.c.CustoCalculado)
+    afetadas = list(deltas)
+    partes = []
+    for start in range(0, len(afetadas), BATCH_SIZE):
+        query = (
+            select(totais.c.ProdutoCodigo, produtos.c.produto, custo_atual, type_coerce(precos.c.preco1, Float))
+            .join(produtos, produtos.c.codigo == totais.c.ProdutoCodigo)
+            .outerjoin(multinivel, multinivel.c.ProdutoCodigo == totais.c.ProdutoCodigo)
+            .outerjoin(precos, precos.c.produtoCodigo == totais.c.ProdutoCodigo)
+            .where(totais.c.ProdutoCodigo.in_(afetadas[start:start + BATCH_SIZE]))
+        )
+        partes.append(pd.DataFrame(db.session.execute(query).all(), columns=["codigo", "nome", "custo_atual", "preco1"]))
+
+    if not partes:
+        return pd.DataFrame(columns=["codigo", "nome", "custo_atual", "preco1", "delta"])
+    frame = pd.concat(partes, ignore_index=True)
+    frame["delta"] = frame["codigo"].map(deltas)
+    return frame
+
+
+# Custo das fichas com os preços dos componentes alterados, sem escrever na BD.
+# variacoes = {componente: fração (0.12 = +12%)}; o custo de cada linha varia
+# na mesma proporção do preço do componente e chega, pelas sub-fichas, às
+# fichas que o usam indiretamente (custo multinível).
+def simular_precos(variacoes):
+    resultado = _deltas(variacoes)
+    if resultado.empty:
+        return []
+
+    resultado["custo_novo"] = resultado["custo_atual"] + resultado["delta"]
+    resultado["delta_pct"] = resultado["delta"] / resultado["custo_atual"].where(resultado["custo_atual"] != 0) * 100
+    # food cost como na lista de fichas: custo / PVP (preco1), em %
+    preco1 = resultado["preco1"].round(4).where(resultado["preco1"] > 0)
+    resultado["food_cost_atual"] = resultado["custo_atual"] / preco1 * 100
+    resultado["food_cost_novo"] = resultado["custo_novo"] / preco1 * 100
+
+    ordem = np.lexsort((resultado["codigo"].to_numpy(), -resultado["delta"].abs().to_numpy()))
+    resultado = resultado.iloc[ordem]
+    colunas = [
+        [None if pd.isna(valor) else valor for valor in resultado[coluna].tolist()]
+        for coluna in COLUNAS
+    ]
+    return [dict(zip(COLUNAS, linha)) for linha in zip(*colunas)]
@@ -0,0 +1,80 @@
+import threading
+import time
+
+from flask import jsonify
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
+
+from models import db
+
+
+def _sqlite_pragmas(config):
+    return [
+        # WAL: as leituras continuam a ver o último catálogo confirmado enquanto
+        # uma importação escreve, sem "database is locked"
+        "PRAGMA journal_mode=WAL",
+        f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT_MS'])}",
+        f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}",
+        # valor negativo: tamanho em KiB em vez de nº de páginas
+        f"PRAGMA cache_size=-{int(config['SQLITE_CACHE_SIZE_KB'])}",
+        f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}",
+    ]
+
+
+def init_storage(app):
+    pragmas = _sqlite_pragmas(app.config)
+
+    def _configure_sqlite(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+    with app.app_context():
+        # a BD principal e a dos trabalhos de importação
+        for engine in db.engines.values():
+            if engine.dialect.name == "sqlite":
+                event.listen(engine, "connect", _configure_sqlite)
+
+    @app.errorhandler(OperationalError)
+    def _base_de_dados_ocupada(exc):
+        # com SQLite uma importação tem o lock de escrita até ao commit: quem
+        # escreve entretanto esgota o busy_timeout e pode repetir mais tarde
+        if "database is locked" not in str(exc.orig):
+            raise exc
+        db.session.rollback()
+        response = jsonify({"error": "Base de dados ocupada com uma importação em curso. Tente novamente."})
+        response.status_code = 503
+        response.headers["Retry-After"] = "30"
+        return response
+
+    interval = app.config.get("DB_OPTIMIZE_INTERVAL") or 0
+    if interval > 0:
+        threading.Thread(
+            target=_optimize_loop, args=(app, interval), name="db-optimize", daemon=True
+        ).start()
+
+
+def _optimize_loop(app, interval):
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            try:
+                optimize_database()
+            except Exception as exc:
+                app.logger.warning("Falha a otimizar a base de dados: %s", exc)
+
+
+# Atualiza as estatísticas do planeador; corre periodicamente e depois de cada
+# importação, que é quando o volume das tabelas muda de forma significativa
+def optimize_database():
+    dialect = db.engine.dialect.name
+    with db.engine.connect() as connection:
+        if dialect == "sqlite":
+            # analysis_limit limita o custo do ANALYZE em tabelas grandes
+            connection.execute(text("PRAGMA analysis_limit=1000"))
+            connection.execute(text("ANALYZE"))
+            connection.execute(text("PRAGMA optimize"))
+        elif dialect == "postgresql":
+            connection.execute(text("ANALYZE"))
+        connection.commit()
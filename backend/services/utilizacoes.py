@@ -0,0 +1,128 @@
+from sqlalchemy import Float, delete, select, type_coerce
+
+from models import ComponenteUtilizacao, FichaTecnica, db
+from services.bulk_upsert import BATCH_SIZE, bulk_insert, em_lotes
+from services.grafo_fichas import ascendentes
+
+
+# Recalcula as utilizações (diretas e através de sub-fichas) das fichas
+# indicadas e de todas as que as usam, na transação corrente. As sub-fichas
+# fora desse conjunto não mudaram: as suas utilizações são lidas da tabela.
+def recompute_utilizacoes(codigos, batch_size=BATCH_SIZE):
+    afetados = ascendentes(codigos, batch_size)
+    fichas = FichaTecnica.__table__
+    table = ComponenteUtilizacao.__table__
+
+    linhas = {}
+    for chunk in em_lotes(afetados, batch_size):
+        query = (
+            select(fichas.c.codigo, fichas.c.componenteCodigo, type_coerce(fichas.c.qtd, Float))
+            .where(fichas.c.codigo.in_(chunk))
+            .order_by(fichas.c.ordem, fichas.c.id)
+        )
+        for codigo, componente, qtd in db.session.execute(query):
+            # arredondada como Numeric(12, 4)
+            linhas.setdefault(codigo, []).append((componente, round(qtd or 0.0, 4)))
+
+    externos = {}
+    fora = {componente for ls in linhas.values() for componente, _ in ls} - afetados
+    for chunk in em_lotes(fora, batch_size):
+        query = select(table.c.FichaCodigo, table.c.ComponenteCodigo, table.c.Profundidade, table.c.Quantidade).where(
+            table.c.FichaCodigo.in_(chunk)
+        )
+        for ficha, componente, profundidade, quantidade in db.session.execute(query):
+            externos.setdefault(ficha, {})[componente] = (profundidade, quantidade)
+
+    calculados = {}
+
+    # ({componente: (profundidade, quantidade, via, qtd da via)}, cortes), pelo
+    # caminho mais curto; num ciclo não se volta a uma ficha ainda em cálculo
+    # (cortes = essas fichas). Um resultado com cortes depende de quem está na
+    # pilha e não se guarda: a ficha volta a ser calculada fora desse caminho.
+    def _descendentes(codigo, pilha):
+        if codigo in calculados:
+            return calculados[codigo], set()
+        if codigo not in linhas:
+            return externos.get(codigo, {}), set()
+
+        pilha.add(codigo)
+        resultado, cortes = {}, set()
+        for componente, qtd in linhas[codigo]:
+            resultado.setdefault(componente, (1, qtd, componente, qtd))
+        for componente, qtd in linhas[codigo]:
+            if componente in pilha:
+                cortes.add(componente)
+                continue
+            descendentes, sub_cortes = _descendentes(componente, pilha)
+            cortes |= sub_cortes
+            for sub, (profundidade, quantidade, *_) in descendentes.items():
+                atual = resultado.get(sub)
+                if atual is None or profundidade + 1 < atual[0]:
+                    resultado[sub] = (profundidade + 1, qtd * quantidade, componente, qtd)
+        pilha.discard(codigo)
+        # os caminhos cortados na própria ficha voltavam a ela: nunca são os mais curtos
+        cortes.discard(codigo)
+        if not cortes:
+            calculados[codigo] = resultado
+        return resultado, cortes
+
+    for chunk in em_lotes(afetados, batch_size):
+        db.session.execute(delete(table).where(table.c.FichaCodigo.in_(chunk)))
+
+    registos = []
+    for codigo in afetados:
+        for componente, (profundidade, quantidade, via, qtd_via) in _descendentes(codigo, set())[0].items():
+            registos.append({
+                "ComponenteCodigo": componente,
+                "FichaCodigo": codigo,
+                "Profundidade": profundidade,
+                "ViaCodigo": via,
+                "QtdVia": qtd_via,
+                "Quantidade": quantidade,
+            })
+            if len(registos) >= batch_size * 20:
+                bulk_insert(table, registos, batch_size)
+                registos = []
+    bulk_insert(table, registos, batch_size)
+
+
+# Caminho de cada ficha até ao componente, [(codigo, qtd), ...], seguindo as vias
+def caminhos(componente, utilizacoes, batch_size=BATCH_SIZE):
+    table = ComponenteUtilizacao.__table__
+    passos = {u.FichaCodigo: (u.ViaCodigo, u.QtdVia) for u in utilizacoes}
+    consultados = set(passos)
+    # uma consulta por nível: as vias que ainda não estão na página
+    while True:
+        em_falta = {via for via, _ in passos.values() if via != componente} - consultados
+        if not em_falta:
+            break
+        consultados |= em_falta
+        for chunk in em_lotes(em_falta, batch_size):
+            query = select(table.c.FichaCodigo, table.c.ViaCodigo, table.c.QtdVia).where(
+                table.c.ComponenteCodigo == componente, table.c.FichaCodigo.in_(chunk)
+            )
+            for ficha, via, qtd in db.session.execute(query):
+                passos[ficha] = (via, qtd)
+
+    resultado = {}
+    for utilizacao in utilizacoes:
+        caminho, atual = [], utilizacao.FichaCodigo
+        for _ in range(utilizacao.Profundidade):
+            if atual not in passos:
+                break
+            via, qtd = passos[atual]
+            caminho.append((via, qtd))
+            atual = via
+        resultado[utilizacao.FichaCodigo] = caminho
+    return resultado
+
+
+def backfill_utilizacoes():
+    # bases de dados com fichas anteriores a esta tabela
+    vazia = db.session.execute(select(ComponenteUtilizacao.Id).limit(1)).first() is None
+    if not vazia:
+        return
+    codigos = db.session.scalars(select(FichaTecnica.codigo).distinct()).all()
+    if codigos:
+        recompute_utilizacoes(codigos)
+        db.session.commit()
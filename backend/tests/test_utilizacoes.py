@@ -0,0 +1,72 @@
+from flask import Flask
+
+from models import ComponenteUtilizacao, FichaTecnica, Produto, db
+from routes.api_componentes import componentes_bp
+from services.utilizacoes import recompute_utilizacoes
+
+
+def _app(tmp_path):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path}/catalogo.db"
+    app.config["SQLALCHEMY_BINDS"] = {"jobs": f"sqlite:///{tmp_path}/jobs.db"}
+    db.init_app(app)
+    app.register_blueprint(componentes_bp)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def _indice():
+    return {
+        (u.FichaCodigo, u.ComponenteCodigo): (u.Profundidade, u.ViaCodigo, u.Quantidade)
+        for u in ComponenteUtilizacao.query.all()
+    }
+
+
+# A -> B, A -> D, B -> A, B -> C: A e B fazem um ciclo
+def test_utilizacoes_com_ciclo(tmp_path):
+    app = _app(tmp_path)
+    linhas = [("A", "B", 2), ("A", "D", 3), ("B", "A", 5), ("B", "C", 7)]
+    with app.app_context():
+        db.session.add_all(Produto(codigo=codigo, produto=codigo) for codigo in "ABCD")
+        db.session.add_all(
+            FichaTecnica(codigo=codigo, componenteCodigo=componente, qtd=qtd, ordem=ordem)
+            for ordem, (codigo, componente, qtd) in enumerate(linhas)
+        )
+        db.session.flush()
+        recompute_utilizacoes(["A", "B"])
+        db.session.commit()
+
+        indice = _indice()
+        assert indice[("A", "B")] == (1, "B", 2)
+        assert indice[("A", "D")] == (1, "D", 3)
+        assert indice[("A", "C")] == (2, "B", 14)
+        assert indice[("A", "A")] == (2, "B", 10)
+        assert indice[("B", "A")] == (1, "A", 5)
+        assert indice[("B", "C")] == (1, "C", 7)
+        assert indice[("B", "D")] == (2, "A", 15)
+        assert indice[("B", "B")] == (2, "A", 10)
+        assert len(indice) == 8
+
+    resposta = app.test_client().get("/api/componentes/C/utilizacoes")
+    assert resposta.status_code == 200
+    assert {u["ficha_codigo"] for u in resposta.get_json()["utilizacoes"]} == {"A", "B"}
+
+
+# a mesma ficha recalculada a partir de qualquer ponto do ciclo dá o mesmo índice
+def test_utilizacoes_com_ciclo_independente_da_ordem(tmp_path):
+    app = _app(tmp_path)
+    linhas = [("A", "B", 1), ("B", "C", 1), ("C", "A", 1), ("C", "X", 1)]
+    with app.app_context():
+        db.session.add_all(Produto(codigo=codigo, produto=codigo) for codigo in "ABCX")
+        db.session.add_all(
+            FichaTecnica(codigo=codigo, componenteCodigo=componente, qtd=qtd, ordem=ordem)
+            for ordem, (codigo, componente, qtd) in enumerate(linhas)
+        )
+        db.session.flush()
+        recompute_utilizacoes(["A"])
+        primeiro = _indice()
+        recompute_utilizacoes(["C"])
+        assert _indice() == primeiro
+        assert {ficha for ficha, componente in primeiro if componente == "X"} == {"A", "B", "C"}
+        assert primeiro[("A", "X")][0] == 3
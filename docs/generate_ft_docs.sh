@@ -391,6 +391,7 @@ cat << 'E10' > docs/10_ERROR_CODES.md
 - E001 – Ficheiro sem folhas
 - E002 – Ficheiro com mais de uma folha
 - E003 – Ficheiro não é Excel válido
+- E004 – Mais de um ficheiro do mesmo tipo no pacote
 
 ## Erros de cabeçalho
 - E010 – Cabeçalho obrigatório em falta (ex.: Codigo)
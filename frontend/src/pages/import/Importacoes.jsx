@@ -1,6 +1,6 @@
 import React from 'react';
 import { Link } from 'react-router-dom';
-import { DocumentArrowUpIcon, CurrencyEuroIcon, ClipboardDocumentListIcon } from '@heroicons/react/24/outline';
+import { DocumentArrowUpIcon, CurrencyEuroIcon, ClipboardDocumentListIcon, ArchiveBoxArrowDownIcon } from '@heroicons/react/24/outline';
 
 export default function Importacoes() {
   return (
@@ -25,6 +25,13 @@ export default function Importacoes() {
             <h2 className="text-4xl font-bold">Importar Fichas Técnicas</h2>
           </div>
         </Link>
+        <Link to="/importar/bundle" className="block group md:col-span-3">
+          <div className="bg-gradient-to-br from-[var(--color-primary-700)] to-[var(--color-secondary-800)] text-on-primary rounded-3xl shadow-2xl p-12 text-center transform group-hover:scale-105 transition">
+            <ArchiveBoxArrowDownIcon className="w-24 h-24 mx-auto mb-6" />
+            <h2 className="text-4xl font-bold">Importar Pacote Completo</h2>
+            <p className="text-2xl mt-4">Produtos, fichas e preços de uma só vez (zip ou vários ficheiros)</p>
+          </div>
+        </Link>
       </div>
     </div>
   );
@@ -1,47 +1,136 @@
-import React, { useState } from 'react';
+import React, { useCallback, useEffect, useRef, useState } from 'react';
 import { useParams, Link } from 'react-router-dom';
 import { ArrowLeftIcon } from '@heroicons/react/24/outline';
 import axios from 'axios';
 
+const INTERVALO_POLLING_MS = 1000;
+
+const chaveJob = (tipo) => `importacao:job:${tipo}`;
+
+function mensagemResultado(detalhes) {
+  if (detalhes?.dryRun && detalhes.status === 'sucesso') {
+    // avisos: valores que ficam vazios e produtos que serão criados, sem impedir a importação
+    const avisos = detalhes.numAvisos ? ` (${detalhes.numAvisos} avisos)` : '';
+    return `VALIDAÇÃO OK! ${detalhes.linhasValidas} linhas prontas a importar.${avisos}`;
+  }
+
+  if (detalhes?.status === 'sucesso' && detalhes.semAlteracoes) {
+    return 'SUCESSO! Ficheiro idêntico à última importação: sem alterações.';
+  }
+
+  if (detalhes?.status === 'sucesso') {
+    const linhas = Object.entries({
+      produtos: detalhes.produtos,
+      fichas: detalhes.fichas,
+      ingredientes: detalhes.ingredientes,
+      precos: detalhes.precos,
+    })
+      .filter(([, valor]) => valor > 0)
+      .map(([chave, valor]) => `${valor} ${chave}`)
+      .join(' | ');
+
+    return `SUCESSO! ${detalhes.tipo} importados. ${linhas}`.trim();
+  }
+
+  if (detalhes?.erros?.length) {
+    const primeiro = detalhes.erros[0];
+    const codigo = primeiro.codigo ? `[${primeiro.codigo}] ` : '';
+    // o resultado traz só os primeiros erros; o total vem em numErros
+    const outros = (detalhes.numErros || detalhes.erros.length) - 1;
+    const sufixo = outros > 0 ? ` (+${outros} erros)` : '';
+    return `ERRO: ${codigo}${primeiro.mensagem || 'Falha a importar ficheiro.'}${sufixo}`;
+  }
+
+  return 'ERRO: Resultado inesperado na importação.';
+}
+
+function mensagemProgresso(job) {
+  const linhas = job.linhasProcessadas || 0;
+  const ritmo = job.linhasPorSegundo ? ` (${Math.round(job.linhasPorSegundo)} linhas/s)` : '';
+  if (job.estado === 'pendente') return 'Importação em fila...';
+  return `A importar... ${linhas} linhas processadas${ritmo}`;
+}
+
 export default function ImportarTipo() {
   const { tipo } = useParams();
-  const titulo = tipo === 'produtos' ? 'Produtos Base' : tipo === 'precos' ? 'Preços & Taxas' : 'Fichas Técnicas';
-  const [file, setFile] = useState(null);
+  const pacote = tipo === 'bundle';
+  const titulo = tipo === 'produtos' ? 'Produtos Base' : tipo === 'precos' ? 'Preços & Taxas' : pacote ? 'Pacote Completo' : 'Fichas Técnicas';
+  const [files, setFiles] = useState([]);
+  const file = files[0];
   const [msg, setMsg] = useState('');
+  const [jobId, setJobId] = useState(() => localStorage.getItem(chaveJob(tipo)));
+  const timer = useRef(null);
+
+  const terminarJob = useCallback(() => {
+    localStorage.removeItem(chaveJob(tipo));
+    setJobId(null);
+  }, [tipo]);
+
+  useEffect(() => {
+    if (!jobId) return undefined;
+
+    let ativo = true;
+    const consultar = async () => {
+      try {
+        const res = await axios.get(`/api/import/jobs/${jobId}`);
+        if (!ativo) return;
+        const job = res.data;
+        if (job.estado === 'sucesso' || job.estado === 'erro') {
+          setMsg(mensagemResultado(job.resultado));
+          terminarJob();
+          return;
+        }
+        setMsg(mensagemProgresso(job));
+        timer.current = setTimeout(consultar, INTERVALO_POLLING_MS);
+      } catch (e) {
+        if (!ativo) return;
+        setMsg('ERRO: ' + (e.response?.data?.error || e.message));
+        terminarJob();
+      }
+    };
+
+    consultar();
+    return () => {
+      ativo = false;
+      clearTimeout(timer.current);
+    };
+  }, [jobId, terminarJob]);
 
   const upload = async () => {
     if (!file) return;
-    setMsg('A importar...');
+    setMsg('A enviar ficheiro...');
     const form = new FormData();
-    form.append('file', file);
+    // no pacote seguem todos os ficheiros (ou um zip) no mesmo pedido
+    files.forEach((f) => form.append('file', f));
     form.append('tipo', tipo);
     try {
       const res = await axios.post('/api/import', form);
-      const detalhes = res.data?.detalhes;
-      if (detalhes?.status === 'sucesso') {
-        const linhas = Object.entries({
-          produtos: detalhes.produtos,
-          fichas: detalhes.fichas,
-          ingredientes: detalhes.ingredientes,
-          precos: detalhes.precos,
-        })
-          .filter(([, valor]) => valor > 0)
-          .map(([chave, valor]) => `${valor} ${chave}`)
-          .join(' | ');
-
-        setMsg(`SUCESSO! ${detalhes.tipo} importados. ${linhas}`.trim());
+      const job = res.data?.job;
+      if (job?.id) {
+        // o id fica guardado para retomar o acompanhamento após recarregar a página
+        localStorage.setItem(chaveJob(tipo), job.id);
+        setJobId(job.id);
       } else {
         setMsg('ERRO: Resultado inesperado na importação.');
       }
     } catch (e) {
-      const detalhesErro = e.response?.data?.detalhes;
-      if (detalhesErro?.erros?.length) {
-        const primeiro = detalhesErro.erros[0];
-        const codigo = primeiro.codigo ? `[${primeiro.codigo}] ` : '';
-        setMsg(`ERRO: ${codigo}${primeiro.mensagem || 'Falha a importar ficheiro.'}`);
-      } else {
-        setMsg('ERRO: ' + (e.response?.data?.error || e.message));
-      }
+      setMsg('ERRO: ' + (e.response?.data?.error || e.message));
+    }
+  };
+
+  // valida o ficheiro sem importar (dryRun): a resposta é o relatório completo
+  const validar = async () => {
+    if (!file) return;
+    setMsg('A validar ficheiro...');
+    const form = new FormData();
+    form.append('file', file);
+    form.append('tipo', tipo);
+    form.append('dryRun', '1');
+    try {
+      const res = await axios.post('/api/import', form);
+      setMsg(mensagemResultado(res.data));
+    } catch (e) {
+      setMsg('ERRO: ' + (e.response?.data?.error || e.message));
     }
   };
 
@@ -51,11 +140,14 @@ export default function ImportarTipo() {
         <ArrowLeftIcon className="w-10 h-10" /> Voltar
       </Link>
       <h1 className="text-6xl font-black mb-16 text-center">{titulo}</h1>
-      <input type="file" accept=".xlsx" onChange={e => setFile(e.target.files[0])} className="block w-full text-2xl file:py-6 file:px-12 file:rounded-full file:bg-[var(--color-primary-600)] file:text-on-primary" />
-      {file && <p className="mt-8 text-3xl font-bold text-center text-primary-strong">{file.name}</p>}
-      <button onClick={upload} disabled={!file} className="mt-16 w-full py-8 bg-[var(--color-primary-600)] text-on-primary text-4xl font-bold rounded-3xl hover:bg-[var(--color-primary-700)] disabled:bg-[var(--color-neutral-300)]">
+      <input type="file" accept={pacote ? '.xlsx,.zip' : '.xlsx'} multiple={pacote} onChange={e => setFiles(Array.from(e.target.files))} className="block w-full text-2xl file:py-6 file:px-12 file:rounded-full file:bg-[var(--color-primary-600)] file:text-on-primary" />
+      {file && <p className="mt-8 text-3xl font-bold text-center text-primary-strong">{files.map((f) => f.name).join(', ')}</p>}
+      <button onClick={upload} disabled={!file || Boolean(jobId)} className="mt-16 w-full py-8 bg-[var(--color-primary-600)] text-on-primary text-4xl font-bold rounded-3xl hover:bg-[var(--color-primary-700)] disabled:bg-[var(--color-neutral-300)]">
         INICIAR IMPORTAÇÃO
       </button>
+      {!pacote && <button onClick={validar} disabled={!file || Boolean(jobId)} className="mt-6 w-full py-6 border-4 border-[var(--color-primary-600)] text-primary-strong text-3xl font-bold rounded-3xl hover:bg-[var(--color-neutral-100)] disabled:border-[var(--color-neutral-300)] disabled:text-[var(--color-neutral-300)]">
+        VALIDAR SEM IMPORTAR
+      </button>}
       {msg && <p className="mt-12 text-3xl font-bold text-center">{msg}</p>}
     </div>
   );
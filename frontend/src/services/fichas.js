@@ -107,6 +107,13 @@ export async function fetchFichas() {
   return response.data.map(mapFichaResponse);
 }
 
+export async function pesquisarProdutos(q, { page = 1, limit = 20, fichas = false } = {}) {
+  const response = await axios.get('/api/pesquisa', {
+    params: { q, page, limit, ...(fichas ? { fichas: 1 } : {}) },
+  });
+  return response.data;
+}
+
 export async function atualizarAtributosTecnicos(codigo, atributos) {
   const response = await axios.patch(`/api/fichas/${codigo}/atributos`, atributos);
   return mapFichaResponse(response.data);